@@ -0,0 +1,417 @@
+import argparse
+import contextlib
+import itertools
+import json
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+import lambda_function
+
+SIZES = (10_000, 100_000, 1_000_000)
+
+DASHBOARD_PATH = Path(__file__).parent / "dashboard" / "dashboards" / "dashboard.json"
+
+# per-stage results of the replay benchmark, see benchmark_replay()
+BASELINE_PATH = Path(__file__).with_name("benchmarks_baseline.json")
+# a stage regresses when it is this many times slower or larger than its baseline, and by more than the floor
+TIME_TOLERANCE, TIME_FLOOR_SECONDS = 1.5, 0.05
+MEMORY_TOLERANCE, MEMORY_FLOOR_MIB = 1.25, 1.0
+
+REPLAY_EVENT: lambda_function.EventConfig = {
+    "event_id": 1,
+    "name": "Replay",
+    "origin": "https://example.com",
+    "startlist": "000-Startlists|Startlist",
+    "waitlist": "000-Startlists|Waitlist",
+}
+
+# panel queries as they were before the summary tables, scanning athletes_df
+PANEL_QUERIES_BEFORE = {
+    "Nationality": (
+        "SELECT COUNT(*) as athlete_count, country FROM athletes_df "
+        "WHERE country IS NOT NULL GROUP BY country ORDER BY athlete_count DESC"
+    ),
+    "Age histogram": "SELECT age FROM athletes_df WHERE age IS NOT NULL ORDER BY age",
+    "Top 10 Companies": (
+        "SELECT LEFT(company, 20) as Company, COUNT(*) as athlete_count FROM athletes_df "
+        "WHERE company IS NOT NULL GROUP BY company ORDER BY athlete_count DESC LIMIT 10"
+    ),
+    "Athletes per Club": (
+        "SELECT club, COUNT(*) as athlete_count FROM athletes_df "
+        "WHERE club IS NOT NULL GROUP BY club ORDER BY athlete_count DESC"
+    ),
+    "Total Participants": "SELECT COUNT(*) as total_participants FROM athletes_df",
+    "Olympic": "SELECT COUNT(*) as total_participants FROM athletes_df where contest_category_id = 1",
+    "Not Olympic": "SELECT COUNT(*) as total_participants FROM athletes_df where contest_category_id != 1",
+}
+
+# cold `import lambda_function` budget, heavy dependencies are expected to load lazily
+STARTUP_BUDGET_SECONDS = 0.1
+
+CATEGORIES = ["#1_Olympisch", "#2_Sprint", "#3_{DE:Staffel|EN:Relay}", "#5_Jugendtriathlon U14"]
+COUNTRIES = ["SUI", "GER", "FRA", "ITA", "AUT", "GBR", "USA", "XKX", "UMI", ""]
+CLUBS = ["", "Blaue Funken Köln", "Schweiz", "TV Zürich", "-", "N/A", "Tri Team Basel"]
+
+
+def synthetic_startlist(n: int, seed: int = 0) -> dict[str, list[list[str]]]:
+    """Build a raceresult startlist `data` mapping with `n` athletes spread over a few categories."""
+    rng = random.Random(seed)
+    data = {category: [] for category in CATEGORIES}
+    for bib in range(1, n + 1):
+        data[CATEGORIES[bib % len(CATEGORIES)]].append(
+            [
+                str(bib),
+                "",
+                f" Athlete{bib} LASTNAME{rng.randint(0, 999)} ",
+                rng.choice(["M", "W", "Männlich", "Weiblich"]),
+                "",
+                rng.choice(["M20-34", "W20-34", "M35-44", "W35-44"]),
+                rng.choice(CLUBS),
+                rng.choice(["", "", "Company"]),
+                "[img:https://timit.ch/graphics/flags/ch_black.png|height:16px;width:20px;]",
+                rng.choice(COUNTRIES),
+                str(rng.randint(1950, 2014)),
+            ]
+        )
+    return data
+
+
+def benchmark_writers(database_url: str, sizes: tuple[int, ...] = SIZES) -> None:
+    """Compare the COPY writer against pandas to_sql when (re)loading `athletes_df`."""
+    engine = create_engine(database_url)
+    athletes_df = lambda_function.process_athlete_data(synthetic_startlist(max(sizes)))
+
+    print(f"{'rows':>10} {'writer':>8} {'seconds':>9}")
+    for size in sizes:
+        df = athletes_df.head(size)
+        for writer in ("to_sql", "copy"):
+            with engine.begin() as connection:
+                connection.execute(text('DROP TABLE IF EXISTS "benchmark_athletes_df"'))
+                df.head(0).to_sql("benchmark_athletes_df", connection, index=False)
+
+            started = time.perf_counter()
+            with engine.begin() as connection:
+                lambda_function.insert_rows(connection, df, "benchmark_athletes_df", writer)
+            print(f"{size:>10} {writer:>8} {time.perf_counter() - started:>9.2f}")
+
+    with engine.begin() as connection:
+        connection.execute(text('DROP TABLE IF EXISTS "benchmark_athletes_df"'))
+    engine.dispose()
+
+
+def benchmark_panels(database_url: str, size: int = 100_000, repeat: int = 20) -> None:
+    """Time the dashboard panel queries on `size` athletes, against athletes_df and against the summary tables."""
+    panel_queries_after = {
+        panel["title"]: panel["targets"][0]["rawSql"].replace("public.", "").replace("$event_id", "1")
+        for panel in json.loads(DASHBOARD_PATH.read_text(encoding="utf-8"))["panels"]
+        if panel["title"] in PANEL_QUERIES_BEFORE and panel["type"] != "timeseries"
+    }
+
+    admin_engine = create_engine(database_url)
+    with admin_engine.begin() as connection:
+        connection.execute(text("DROP SCHEMA IF EXISTS benchmark CASCADE"))
+        connection.execute(text("CREATE SCHEMA benchmark"))
+    engine = create_engine(database_url, connect_args={"options": "-csearch_path=benchmark"})
+
+    athletes_df = lambda_function.process_athlete_data(synthetic_startlist(size))
+    athletes_df.insert(0, "event_id", 1)
+    with engine.begin() as connection:
+        lambda_function.upsert_table(
+            connection, athletes_df, "athletes_df", lambda_function.TABLE_KEYS["athletes_df"], writer="copy"
+        )
+        lambda_function.refresh_aggregates(connection, 1)
+        connection.execute(text("ANALYZE"))
+
+    print(f"{'panel':<20} {'before ms':>10} {'after ms':>10}")
+    with engine.connect() as connection:
+        for title, before in PANEL_QUERIES_BEFORE.items():
+            timings = []
+            for sql in (before, panel_queries_after[title]):
+                samples = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    connection.execute(text(sql)).all()
+                    samples.append(time.perf_counter() - started)
+                timings.append(statistics.median(samples) * 1000)
+            print(f"{title:<20} {timings[0]:>10.2f} {timings[1]:>10.2f}")
+
+    with admin_engine.begin() as connection:
+        connection.execute(text("DROP SCHEMA benchmark CASCADE"))
+    engine.dispose()
+    admin_engine.dispose()
+
+
+# how benchmark_memory decodes a list response: the whole document at once, or category by category
+LIST_DECODERS = {"document": json.loads, "categories": lambda_function.decode_list_response}
+
+
+def measure_list_memory(body_path: str, decoder: str) -> None:
+    """
+    Decode the list response in `body_path` with `decoder` and build its athletes frame, printing the seconds and the
+    peak RSS above the process before the response was read (interpreter, modules and warm caches).
+    """
+    lambda_function.process_athlete_data(synthetic_startlist(100))
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    body = Path(body_path).read_bytes()
+    response = LIST_DECODERS[decoder](body)
+    del body
+    df = lambda_function.process_athlete_data(response["data"])
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    print(f"{len(df)} {elapsed:.2f} {peak / 1024:.1f}")
+
+
+def benchmark_memory(sizes: tuple[int, ...] = SIZES) -> None:
+    """
+    Peak RSS of fetching (reading and decoding the response) and processing a start list, per decoder.
+
+    Every measurement runs in a fresh interpreter, since the peak RSS of a process never goes down.
+    """
+    print(f"{'rows':>10} {'decoder':>10} {'seconds':>9} {'peak MiB':>9} {'body MiB':>9}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            body_path = Path(directory) / "startlist.json"
+            body_path.write_text(json.dumps({"data": synthetic_startlist(size)}), encoding="utf-8")
+            for decoder in LIST_DECODERS:
+                result = subprocess.run(
+                    [
+                        sys.executable,
+                        "-c",
+                        f"import benchmarks; benchmarks.measure_list_memory({str(body_path)!r}, {decoder!r})",
+                    ],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                    cwd=Path(__file__).parent,
+                )
+                _, elapsed, peak = result.stdout.split()
+                body_mib = body_path.stat().st_size / 2**20
+                print(f"{size:>10} {decoder:>10} {float(elapsed):>9.2f} {float(peak):>9.1f} {body_mib:>9.1f}")
+
+
+def synthetic_recording(n: int, seed: int = 0) -> lambda_function.Recording:
+    """Recorded config and list responses of an event with `n` athletes, one in twenty on the wait list."""
+    rng = random.Random(seed)
+    wait_list = {
+        f"{CATEGORIES[0]} - Warteliste": [
+            [
+                str(rank),
+                str(100_000 + rank),
+                str(rank),
+                f" Waiting{rank} ATHLETE ",
+                "M",
+                "M20-34",
+                "",
+                rng.choice(COUNTRIES),
+            ]
+            for rank in range(1, n // 20 + 1)
+        ]
+    }
+    config: lambda_function.ConfigResponse = {
+        "key": "replay",
+        "eventname": "Replay",
+        "contests": {category[1]: category[3:] for category in CATEGORIES},
+        "splits": [],
+        "lists": [{"Name": REPLAY_EVENT["startlist"]}, {"Name": REPLAY_EVENT["waitlist"]}],
+    }
+    return {
+        "config": config,
+        "lists": {
+            REPLAY_EVENT["startlist"]: {"data": synthetic_startlist(n, seed)},
+            REPLAY_EVENT["waitlist"]: {"data": wait_list},
+        },
+    }
+
+
+def scale_recording(
+    recording: lambda_function.Recording, event: lambda_function.EventConfig, n: int
+) -> lambda_function.Recording:
+    """Repeat the start list rows of `recording` with fresh bibs until it holds `n` athletes."""
+    response = recording["lists"][event["startlist"]]
+    data_fields = response.get("DataFields")
+    bib = lambda_function.compile_list_schema("athletes", None if data_fields is None else tuple(data_fields))["bib"]
+    rows = [(category, row) for category, athletes in response["data"].items() for row in athletes]
+    data: dict[str, list[list[str]]] = {category: [] for category in response["data"]}
+    for i, (category, row) in zip(range(n), itertools.cycle(rows)):
+        data[category].append([*row[:bib], str(i + 1), *row[bib + 1 :]])
+    return {**recording, "lists": {**recording["lists"], event["startlist"]: {**response, "data": data}}}
+
+
+@contextlib.contextmanager
+def measure(results: dict[str, dict[str, float]], stage: str, traced: bool):
+    """Record the wall time of the block under `stage`, or its peak and retained memory when `traced`."""
+    if traced:
+        tracemalloc.start()
+    started = time.perf_counter()
+    yield
+    if traced:
+        allocated, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.setdefault(stage, {}).update(peak_mib=peak / 2**20, allocated_mib=allocated / 2**20)
+    else:
+        results.setdefault(stage, {})["seconds"] = time.perf_counter() - started
+
+
+def replay_stages(
+    event: lambda_function.EventConfig, recording: lambda_function.Recording, database_url: str | None = None
+) -> dict[str, dict[str, float]]:
+    """
+    Run a recording through fetch (mock transport), processing and, with `database_url`, the DB writer.
+
+    Every stage runs once untimed by tracemalloc for the wall time and once traced for the memory figures,
+    the writer loads into a fresh `benchmark` schema each time.
+    """
+    results: dict[str, dict[str, float]] = {}
+    for traced in (False, True):
+        lambda_function._conditional_cache.clear()
+        transport = lambda_function.replay_transport({event["event_id"]: [recording]})
+        with measure(results, "fetch", traced):
+            config_data, participant_lists = lambda_function.fetch_athlete_data(event, transport)
+        with measure(results, "process", traced):
+            update = lambda_function.prepare_event(event, config_data, participant_lists, {})
+        if database_url is None:
+            continue
+
+        admin_engine = create_engine(database_url)
+        with admin_engine.begin() as connection:
+            connection.execute(text("DROP SCHEMA IF EXISTS benchmark CASCADE"))
+            connection.execute(text("CREATE SCHEMA benchmark"))
+        engine = create_engine(database_url, connect_args={"options": "-csearch_path=benchmark"})
+        with measure(results, "write", traced), engine.begin() as connection:
+            lambda_function.load_event(connection, update, "upsert")
+        engine.dispose()
+        with admin_engine.begin() as connection:
+            connection.execute(text("DROP SCHEMA benchmark CASCADE"))
+        admin_engine.dispose()
+    return results
+
+
+def find_regressions(results: dict[str, dict[str, float]], baseline: dict[str, dict[str, float]]) -> list[str]:
+    """Describe every measurement of `results` that exceeds its baseline beyond the tolerances."""
+    limits = {
+        "seconds": (TIME_TOLERANCE, TIME_FLOOR_SECONDS),
+        "peak_mib": (MEMORY_TOLERANCE, MEMORY_FLOOR_MIB),
+        "allocated_mib": (MEMORY_TOLERANCE, MEMORY_FLOOR_MIB),
+    }
+    regressions = []
+    for stage, measurements in results.items():
+        for name, value in measurements.items():
+            expected = baseline.get(stage, {}).get(name)
+            tolerance, floor = limits[name]
+            if expected is not None and value > expected * tolerance and value - expected > floor:
+                regressions.append(f"{stage} {name}: {value:.2f} vs baseline {expected:.2f}")
+    return regressions
+
+
+def benchmark_replay(
+    sizes: tuple[int, ...] = SIZES,
+    database_url: str | None = None,
+    recording_path: Path | None = None,
+    baseline_path: Path = BASELINE_PATH,
+    update_baseline: bool = False,
+) -> bool:
+    """
+    Replay a recorded (or synthetic) event scaled to each of `sizes` athletes and compare every stage to the
+    stored baseline, returning False on regressions. `update_baseline` stores the results as the new baseline.
+    """
+    event = REPLAY_EVENT
+    if recording_path is not None:
+        recording = json.loads(recording_path.read_text(encoding="utf-8"))
+        event = {**event, **recording.get("event", {})}
+
+    results: dict[str, dict[str, float]] = {}
+    print(f"{'rows':>10} {'stage':>8} {'seconds':>9} {'peak MiB':>9} {'alloc MiB':>10}")
+    for size in sizes:
+        replayed = synthetic_recording(size) if recording_path is None else scale_recording(recording, event, size)
+        for stage, measurements in replay_stages(event, replayed, database_url).items():
+            results[f"{size}/{stage}"] = measurements
+            print(
+                f"{size:>10} {stage:>8} {measurements['seconds']:>9.2f} "
+                f"{measurements['peak_mib']:>9.1f} {measurements['allocated_mib']:>10.1f}"
+            )
+
+    if update_baseline:
+        rounded = {key: {name: round(value, 3) for name, value in m.items()} for key, m in results.items()}
+        baseline_path.write_text(json.dumps(rounded, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        return True
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8")) if baseline_path.exists() else {}
+    regressions = find_regressions(results, baseline)
+    for regression in regressions:
+        print(f"regression {regression}")
+    return not regressions
+
+
+def benchmark_startup(budget: float = STARTUP_BUDGET_SECONDS, runs: int = 5) -> bool:
+    """Measure cold imports of the handler module with `-X importtime`, returning False over `budget`."""
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import lambda_function"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        )
+        # lines look like "import time:  self [us] | cumulative | imported package"
+        rows = [line.split("|") for line in result.stderr.splitlines() if line.startswith("import time:")]
+        imports = {name.strip(): int(cumulative) for _, cumulative, name in rows[1:] if not name[1:].startswith(" ")}
+        timings.append(imports["lambda_function"] / 1_000_000)
+
+    median = statistics.median(timings)
+    slowest = sorted((cumulative, name) for name, cumulative in imports.items())[-5:]
+    print(f"import lambda_function: median {median:.3f}s over {runs} runs (budget {budget:.3f}s)")
+    for cumulative, name in reversed(slowest):
+        print(f"{cumulative / 1_000_000:>9.3f}s {name}")
+    return median <= budget
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipeline benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    writers_parser = subparsers.add_parser("writers", help="COPY vs to_sql load time")
+    writers_parser.add_argument("--database-url", required=True)
+    writers_parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+
+    panels_parser = subparsers.add_parser("panels", help="dashboard panel query latency before/after summaries")
+    panels_parser.add_argument("--database-url", required=True)
+    panels_parser.add_argument("--size", type=int, default=100_000)
+
+    memory_parser = subparsers.add_parser("memory", help="peak RSS of decoding and processing a start list")
+    memory_parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+
+    replay_parser = subparsers.add_parser("replay", help="per-stage time and memory of a replayed event vs baseline")
+    replay_parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    replay_parser.add_argument("--database-url", help="also benchmark the DB writer against this Postgres")
+    replay_parser.add_argument(
+        "--recording", type=Path, help='recorded event (config, lists and optionally the "event" entry) to scale up'
+    )
+    replay_parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    replay_parser.add_argument("--update-baseline", action="store_true")
+
+    startup_parser = subparsers.add_parser("startup", help="cold import time against a budget")
+    startup_parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_SECONDS)
+
+    args = parser.parse_args()
+    if args.benchmark == "writers":
+        benchmark_writers(args.database_url, tuple(args.sizes))
+    elif args.benchmark == "panels":
+        benchmark_panels(args.database_url, args.size)
+    elif args.benchmark == "memory":
+        benchmark_memory(tuple(args.sizes))
+    elif args.benchmark == "replay":
+        ok = benchmark_replay(tuple(args.sizes), args.database_url, args.recording, args.baseline, args.update_baseline)
+        sys.exit(0 if ok else 1)
+    elif args.benchmark == "startup":
+        sys.exit(0 if benchmark_startup(args.budget) else 1)
@@ -1,20 +1,261 @@
+from __future__ import annotations
+
+import contextlib
+import contextvars
 import datetime
-import itertools
+import functools
+import gzip
+import hashlib
+import importlib.util
 import json
+import logging
+import operator
 import os
 import re
 import string
+import sys
+import threading
+import time
+import types
 import typing
-from concurrent.futures import ThreadPoolExecutor
-
-import backoff
-import country_converter
-import httpx
-import pandas as pd
-from sqlalchemy import create_engine
-from sqlalchemy.engine import URL
-
-country_converter.logging.getLogger().setLevel(country_converter.logging.CRITICAL)
+from concurrent.futures import BrokenExecutor, Executor, Future, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+if typing.TYPE_CHECKING:
+    import asyncio
+    import uuid
+
+    import backoff
+    import country_converter
+    import httpx
+    import numpy as np
+    import pandas as pd
+    import sqlalchemy
+    from sqlalchemy.engine import Connection, Engine
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """Return `name` as a module that is only executed on first attribute access."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def load_lazy_modules(*modules: types.ModuleType) -> None:
+    """Execute lazily imported `modules` now: LazyLoader does not lock their first use against other threads."""
+    for module in modules:
+        getattr(module, "__doc__")
+
+
+# heavy dependencies are loaded on first use so cold starts only pay for what a run needs
+if not typing.TYPE_CHECKING:
+    asyncio = lazy_import("asyncio")
+    uuid = lazy_import("uuid")
+    backoff = lazy_import("backoff")
+    country_converter = lazy_import("country_converter")
+    httpx = lazy_import("httpx")
+    np = lazy_import("numpy")
+    pd = lazy_import("pandas")
+    sqlalchemy = lazy_import("sqlalchemy")
+
+# country_converter warns on the root logger for every code it does not know
+logging.getLogger().setLevel(logging.CRITICAL)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# primary key of each output table, used by the incremental loader
+TABLE_KEYS = {
+    "contest_categories_df": ["event_id", "id"],
+    "splits_df": ["event_id", "id"],
+    "athletes_df": ["event_id", "bib"],
+    "athletes_wait_list_df": ["event_id", "id"],
+    "dataset_fingerprints": ["event_id", "name"],
+}
+
+# SCD-2 history and hourly rollup (by contest_category/gender/country) tables kept for the athlete tables
+HISTORY_TABLES = {
+    "athletes_df": "athletes_history",
+    "athletes_wait_list_df": "athletes_wait_list_history",
+}
+ROLLUP_TABLES = {
+    "athletes_df": "athletes_hourly_rollup",
+    "athletes_wait_list_df": "athletes_wait_list_hourly_rollup",
+}
+
+# athletes_df column counted per event in each summary table read by the Grafana dashboard
+AGGREGATE_TABLES = {
+    "athletes_by_country": "country",
+    "athletes_by_club": "club",
+    "athletes_by_company": "company",
+    "athletes_by_age": "age",
+    "athletes_by_contest_category": "contest_category_id",
+}
+
+# managed DDL of the output tables, applied idempotently by migrate_schema() before every load:
+# column types replacing the ones pandas infers (text columns stay text)
+TABLE_COLUMN_TYPES = {
+    "contest_categories_df": {"event_id": "bigint", "id": "smallint"},
+    "splits_df": {
+        "event_id": "bigint",
+        "id": "integer",
+        "split_type": "smallint",
+        "contest_category_id": "smallint",
+        "type_of_sport_id": "smallint",
+    },
+    "athletes_df": {
+        "event_id": "bigint",
+        "bib": "integer",
+        "year_born": "smallint",
+        "contest_category_id": "smallint",
+        "age": "smallint",
+    },
+    "athletes_wait_list_df": {
+        "event_id": "bigint",
+        "autorank": "integer",
+        "id": "integer",
+        "autorank2": "integer",
+        "contest_category_id": "smallint",
+    },
+}
+# natural-key lookup tables (name -> key columns and types), new values are added before each write
+LOOKUP_TABLES = {
+    "gender_lookup": {"gender": "text"},
+    "contest_category_lookup": {"event_id": "bigint", "contest_category_id": "smallint"},
+    "contest_lookup": {"contest": "text"},
+    "age_group_lookup": {"age_group": "text"},
+    "club_lookup": {"club": "text"},
+    "country_lookup": {"country": "text"},
+}
+# lookup tables filled from each output table's columns
+TABLE_LOOKUPS = {
+    "athletes_df": [
+        "gender_lookup",
+        "contest_category_lookup",
+        "contest_lookup",
+        "age_group_lookup",
+        "club_lookup",
+        "country_lookup",
+    ],
+    "athletes_wait_list_df": ["gender_lookup", "contest_category_lookup", "age_group_lookup", "country_lookup"],
+}
+# lookups enforced by foreign keys, the others are value dictionaries (e.g. for dashboard variables) since each
+# foreign key adds a per-row check to the COPY load
+LOOKUP_FOREIGN_KEYS = {"gender_lookup", "contest_category_lookup"}
+# secondary indexes, for the scoped deletes of partial loads and the time series panels. The country, club and
+# company panels read the athletes_by_* summary tables, whose unique (event_id, column) indexes cover them
+TABLE_INDEXES = {
+    "athletes_df": [["event_id", "contest_category_id"]],
+    "athletes_wait_list_df": [["event_id", "contest_category_id"]],
+    "dataset_update_events": [["created_at"], ["event_id", "created_at"]],
+}
+
+# raceresult events to ingest, see load_events()
+EVENTS_PATH = Path(os.environ.get("EVENTS_PATH", Path(__file__).with_name("events.json")))
+EVENT_WORKERS = int(os.environ.get("EVENT_WORKERS", "4"))
+# worker processes for the pandas work of prepare_event, 0 runs it in a thread pool instead. That is the default on
+# AWS Lambda, which has no /dev/shm for multiprocessing's queues, and on a single CPU where pickling only adds time
+PROCESS_WORKERS = int(
+    os.environ.get(
+        "PROCESS_WORKERS",
+        "0" if "AWS_LAMBDA_FUNCTION_NAME" in os.environ or (os.cpu_count() or 1) == 1 else str(os.cpu_count()),
+    )
+)
+
+# how rows are written into each table: "copy" streams CSV through COPY FROM STDIN, "to_sql" uses pandas INSERTs
+TABLE_WRITERS = {
+    "contest_categories_df": "to_sql",
+    "splits_df": "to_sql",
+    "athletes_df": "copy",
+    "athletes_wait_list_df": "copy",
+}
+
+
+# layout of each participant list kind, see compile_list_schema(). "columns" is the positional row layout assumed
+# when a response carries no DataFields, "fields" the raceresult expressions a column is read from when it does.
+# "categorical" columns repeat a handful of values and are held as pandas Categoricals, like the category column
+LIST_SCHEMAS: dict[str, ListSchema] = {
+    "athletes": {
+        # fmt: off
+        "columns": [
+            "bib", "contest", "name", "gender", "start", "age_group", "club",
+            "company", "flag_icon", "country", "year_born"
+        ],
+        # fmt: on
+        "fields": {
+            "bib": ["BIB"],
+            "contest": ["CONTEST", "CONTEST.NAME", "ContestName"],
+            "name": ["DisplayName", "DisplayNameShort", "NAME"],
+            "gender": ["GenderMF", "Gender", "SEX"],
+            "start": ["Start", "StartTime", "T0"],
+            "age_group": ["AgeGroupName1", "AgeGroup1.Name", "AgeGroup"],
+            "club": ["Club", "CLUB"],
+            "company": ["Company", "COMPANY"],
+            "country": ["Nation", "NATION", "Nationality"],
+            "year_born": ["YearOfBirth", "YEAR(DateOfBirth)", "YOB"],
+        },
+        "drop": ["flag_icon"],
+        "categorical": ["contest", "gender", "age_group", "club", "country"],
+        "category_column": "contest_category",
+    },
+    "wait_list": {
+        "columns": ["autorank", "id", "autorank2", "name", "gender", "age_group", "flag_icon", "country"],
+        "fields": {
+            "autorank": ["AutoRank", "AUTORANK"],
+            "id": ["ID"],
+            "autorank2": ["AutoRank2", "WaitlistRank", "WaitlistPosition"],
+            "name": ["DisplayName", "DisplayNameShort", "NAME"],
+            "gender": ["GenderMF", "Gender", "SEX"],
+            "age_group": ["AgeGroupName1", "AgeGroup1.Name", "AgeGroup"],
+            "country": ["Nation", "NATION", "Nationality"],
+        },
+        "drop": ["flag_icon"],
+        "categorical": ["gender", "age_group", "country"],
+        "category_column": "contest_category",
+    },
+    # live results, the split time columns are matched against the config's splits, see split_positions()
+    "results": {
+        "columns": ["bib", "name"],
+        "fields": {"bib": ["BIB"], "name": ["DisplayName", "DisplayNameShort", "NAME"]},
+        "drop": [],
+        "categorical": [],
+        "category_column": "contest_category",
+    },
+}
+
+# data-quality checks of the processed tables, see validate_table(). A check fails when more than `tolerance` of
+# the rows break it, which blocks the event's load. "row_count" compares the rows of every contest category with
+# the previous run's, for categories that had at least `min_rows`
+VALIDATION_CHECKS: dict[str, list[ValidationCheck]] = {
+    "athletes_df": [
+        {"rule": "unique", "columns": ["bib"], "tolerance": 0},
+        {"rule": "range", "columns": ["year_born"], "min": 1900, "max": 2100, "tolerance": 0.01},
+        {"rule": "range", "columns": ["age"], "min": 3, "max": 100, "tolerance": 0.01},
+        {"rule": "values", "columns": ["gender"], "values": ["Male", "Female", "Mixed"], "tolerance": 0.01},
+        {"rule": "country", "columns": ["country"], "tolerance": 0.05},
+        {"rule": "row_count", "columns": [], "min_rows": 50, "tolerance": 0.5},
+    ],
+    "athletes_wait_list_df": [
+        {"rule": "unique", "columns": ["id"], "tolerance": 0},
+        {"rule": "values", "columns": ["gender"], "values": ["Male", "Female", "Mixed"], "tolerance": 0.01},
+        {"rule": "country", "columns": ["country"], "tolerance": 0.05},
+        {"rule": "row_count", "columns": [], "min_rows": 50, "tolerance": 0.5},
+    ],
+}
+
+
+# root of the parquet sink's snapshots, see write_event_parquet()
+PARQUET_PATH = Path(os.environ.get("PARQUET_PATH", "snapshots"))
+PARQUET_COMPRESSION = "zstd"
+
+# CloudWatch namespace of the EMF metric lines printed by emit_metrics()
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "TriathlonPipeline")
 
 
 # config response
@@ -55,10 +296,300 @@ class ConfigResponse(typing.TypedDict):
 
 # list participants response
 class ParticipantListResponse(typing.TypedDict):
-    data: dict[str, list[str]]
+    # rows per category, fetched lists keep each category as its canonical JSON bytes (see decode_list_response)
+    data: dict[str, list[list[str]] | bytes]
+    # raceresult expression behind each row position, not sent by every list
+    DataFields: typing.NotRequired[list[str]]
+
+
+class ListSchema(typing.TypedDict):
+    columns: list[str]
+    fields: dict[str, list[str]]
+    drop: list[str]
+    categorical: list[str]
+    category_column: str
+
+
+class ValidationCheck(typing.TypedDict):
+    # "unique" (over non-null values), "range", "values", "country" (a name country codes resolve to) or
+    # "row_count" (drop per contest category against the previous run)
+    rule: str
+    columns: list[str]
+    # share of the rows allowed to fail
+    tolerance: float
+    min: typing.NotRequired[int]
+    max: typing.NotRequired[int]
+    values: typing.NotRequired[list[str]]
+    min_rows: typing.NotRequired[int]
+
+
+# events.json entry
+class EventConfig(typing.TypedDict):
+    event_id: int
+    name: str
+    origin: str
+    startlist: str
+    waitlist: str
+    # live results list polled by live()
+    results: typing.NotRequired[str]
+
+
+# recorded responses of one event, see replay_transport() and record_events()
+class Recording(typing.TypedDict):
+    config: ConfigResponse
+    lists: dict[str, ParticipantListResponse]
+    event: typing.NotRequired[EventConfig]
+
+
+# an output of the pipeline, see SINKS
+class Sink(typing.TypedDict):
+    # (update, load mode, run id) -> stats per table
+    write_event: typing.Callable[[EventUpdate, str, str], dict[str, dict[str, int]]]
+    # (run id, metrics of the run)
+    write_metrics: typing.Callable[[str, list[StageMetric]], None]
+
+
+# pipeline_run_metrics row, one per timed() block
+class StageMetric(typing.TypedDict):
+    run_id: str
+    event_id: int | None
+    stage: str
+    target: str | None
+    started_at: datetime.datetime
+    seconds: float
+    rows: int | None
+    bytes: int | None
+
+
+# split_times row
+class SplitTime(typing.TypedDict):
+    event_id: int
+    bib: int
+    split_id: int
+    contest_category_id: int
+    time: str
+    seconds: float | None
+    recorded_at: datetime.datetime
+
+
+class EventUpdate(typing.TypedDict):
+    event: EventConfig
+    config_data: ConfigResponse
+    participant_lists: dict[str, ParticipantListResponse]
+    fingerprints: dict[str, str]
+    # frames being processed (see process_table) with their delete scope, None when upstream data is unchanged
+    tables: dict[str, tuple[Future[tuple[pd.DataFrame, list[StageMetric]]], dict[str, list[int]]]] | None
+
+
+def load_events(path: Path = EVENTS_PATH) -> list[EventConfig]:
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+# metrics of the running main() and the event being worked on, timed() blocks outside a run record nothing
+_run_metrics: contextvars.ContextVar[tuple[str, list[StageMetric]] | None] = contextvars.ContextVar(
+    "run_metrics", default=None
+)
+_metrics_event_id: contextvars.ContextVar[int | None] = contextvars.ContextVar("metrics_event_id", default=None)
+
+
+@contextlib.contextmanager
+def timed(stage: str, target: str | None = None) -> typing.Iterator[dict[str, int]]:
+    """
+    Record the duration of the block as a `stage` metric of the current run, `target` naming the list or table.
+
+    The yielded dict takes the "rows" and "bytes" the block handled.
+    """
+    counts: dict[str, int] = {}
+    started_at = datetime.datetime.now(datetime.UTC)
+    started = time.perf_counter()
+    try:
+        yield counts
+    finally:
+        run = _run_metrics.get()
+        if run is not None:
+            run_id, metrics = run
+            metrics.append(
+                {
+                    "run_id": run_id,
+                    "event_id": _metrics_event_id.get(),
+                    "stage": stage,
+                    "target": target,
+                    "started_at": started_at,
+                    "seconds": time.perf_counter() - started,
+                    "rows": counts.get("rows"),
+                    "bytes": counts.get("bytes"),
+                }
+            )
+
+
+def emit_metrics(metrics: list[StageMetric]) -> None:
+    """Print `metrics` as CloudWatch embedded metric format lines, dimensioned by stage and target."""
+    units = {"seconds": "Seconds", "rows": "Count", "bytes": "Bytes"}
+    for metric in metrics:
+        values = {name: metric[name] for name in units if metric[name] is not None}
+        line = {
+            "_aws": {
+                "Timestamp": int(metric["started_at"].timestamp() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": METRICS_NAMESPACE,
+                        "Dimensions": [["stage"], ["stage", "target"]],
+                        "Metrics": [{"Name": name, "Unit": units[name]} for name in values],
+                    }
+                ],
+            },
+            "stage": metric["stage"],
+            "target": metric["target"] or "-",
+            "run_id": metric["run_id"],
+            "event_id": metric["event_id"],
+            **values,
+        }
+        print(json.dumps(line), flush=True)
+
+
+def write_run_metrics(connection: Connection, metrics: list[StageMetric]) -> None:
+    connection.execute(
+        sqlalchemy.text(
+            """
+            CREATE TABLE IF NOT EXISTS "pipeline_run_metrics" (
+                run_id text NOT NULL,
+                event_id bigint,
+                stage text NOT NULL,
+                target text,
+                started_at timestamptz NOT NULL,
+                seconds double precision NOT NULL,
+                rows bigint,
+                bytes bigint
+            )
+            """
+        )
+    )
+    connection.execute(
+        sqlalchemy.text(
+            'CREATE INDEX IF NOT EXISTS "pipeline_run_metrics_started_at_idx" ON "pipeline_run_metrics" (started_at)'
+        )
+    )
+    if metrics:
+        connection.execute(
+            sqlalchemy.text(
+                """
+                INSERT INTO "pipeline_run_metrics" (run_id, event_id, stage, target, started_at, seconds, rows, bytes)
+                VALUES (:run_id, :event_id, :stage, :target, :started_at, :seconds, :rows, :bytes)
+                """
+            ),
+            metrics,
+        )
+
+
+# code -> short country name table, pre-seeded at build time by build_country_names()
+COUNTRY_NAMES_PATH = Path(__file__).with_name("country_names.json")
+
+
+@functools.cache
+def get_country_converter() -> country_converter.CountryConverter:
+    return country_converter.CountryConverter()
+
+
+# tables are processed in parallel threads, country_converter is loaded and used by one at a time and the shared
+# get_country_names() table is only read or extended under _country_names_lock
+_country_converter_lock = threading.Lock()
+_country_names_lock = threading.Lock()
+
+
+def resolve_country_codes(codes: list[str]) -> dict[str, str]:
+    """Map IOC or ISO3 codes to short names with country_converter, keeping unknown codes as they are."""
+    with _country_converter_lock, timed("country_converter") as counts:
+        counts["rows"] = len(codes)
+        cc = get_country_converter()
+        series = pd.Series(codes, dtype=object)
+        names = cc.pandas_convert(series=series, src="IOC", to="name_short", not_found=None)
+        names = cc.pandas_convert(series=names, src="ISO3", to="name_short", not_found=None)
+    return dict(zip(codes, names))
+
+
+@functools.cache
+def get_country_names() -> dict[str, str]:
+    try:
+        return json.loads(COUNTRY_NAMES_PATH.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
+
+
+def build_country_names(path: Path = COUNTRY_NAMES_PATH) -> dict[str, str]:
+    """Write the lookup table for every IOC and ISO3 code known to country_converter."""
+    data = get_country_converter().data
+    codes = sorted({"", *data["IOC"].dropna(), *data["ISO3"].dropna()})
+    country_names = resolve_country_codes(codes)
+    path.write_text(json.dumps(country_names, ensure_ascii=False, sort_keys=True), encoding="utf-8")
+    return country_names
+
+
+def convert_countries(series: pd.Series) -> pd.Series:
+    """Convert IOC/ISO3 country codes to short names, only consulting country_converter for unseen codes."""
+    with timed("convert_countries", series.name) as counts:
+        counts["rows"] = len(series)
+        country_names = get_country_names()
+        codes = series.fillna("")
+        unique_codes = codes.unique()
+        with _country_names_lock:
+            missing = [code for code in unique_codes if code not in country_names]
+            if missing:
+                country_names.update(resolve_country_codes(missing))
+            names = {code: country_names[code] for code in unique_codes}
+        return codes.map(names).replace({"": pd.NA})
+
+
+def on_unique(series: pd.Series, func: typing.Callable[[pd.Series], pd.Series]) -> pd.Series:
+    """Evaluate `func` on the distinct values of `series` only and broadcast the result back to every row."""
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    result = func(pd.Series(uniques, dtype=series.dtype))
+    return result.take(codes).set_axis(series.index).rename(series.name)
+
+
+def map_categories(series: pd.Series, func: typing.Callable[[pd.Series], pd.Series]) -> pd.Series:
+    """
+    Apply `func` to the categories of a categorical `series` instead of its rows.
+
+    Categories mapping to the same value are merged and ones mapping to NA become NA, the result keeps
+    sorted categories.
+    """
+    mapped = func(pd.Series(series.cat.categories, dtype=object))
+    category_codes, categories = pd.factorize(mapped, sort=True)
+    # NA rows have code -1, which picks the trailing -1
+    codes = np.append(category_codes, -1)[series.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(codes, categories), index=series.index, name=series.name)
+
+
+def strip_strings(df: pd.DataFrame) -> pd.DataFrame:
+    """Strip the strings in the text columns of `df` and turn empty strings and None into pd.NA."""
+
+    def strip(values: pd.Series) -> pd.Series:
+        if pd.api.types.infer_dtype(values, skipna=True) in ("string", "empty"):
+            values = values.str.strip()
+        else:
+            # JSON cells can be numbers too, these are kept as they are
+            is_str = values.map(type).eq(str)
+            values = values.where(~is_str, values[is_str].str.strip())
+        return values.where(values.notna() & values.ne(""), pd.NA)
+
+    for column in df.columns[df.dtypes == object]:
+        df[column] = strip(df[column])
+    for column in df.columns[df.dtypes == "category"]:
+        df[column] = map_categories(df[column], strip)
+    return df
+
+
+def capwords(series: pd.Series) -> pd.Series:
+    return on_unique(series, lambda names: names.fillna("").map(string.capwords).replace("", pd.NA))
 
 
-cc = country_converter.CountryConverter()
+def split_contest_category(series: pd.Series) -> tuple[pd.Series, pd.Series]:
+    """Split raw "#<id>_<name>" categories into their id and name, once per distinct category."""
+    category_ids = on_unique(series, lambda categories: categories.str.extract(r"#(\d+)_")[0].astype("Int64"))
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return category_ids, map_categories(series, lambda categories: categories.str.extract(r"_(.*)")[0])
+    category_names = on_unique(series, lambda categories: categories.str.extract(r"_(.*)")[0])
+    return category_ids, category_names
 
 
 def get_english_translation(text):
@@ -68,17 +599,139 @@ def get_english_translation(text):
     return text
 
 
-@backoff.on_exception(backoff.expo, (httpx.RequestError,), max_time=60)
-def fetch_athlete_data() -> tuple[ConfigResponse, dict[str, ParticipantListResponse]]:
+# fetch settings, the concurrency limit bounds the list requests in flight at once
+FETCH_CONCURRENCY = int(os.environ.get("FETCH_CONCURRENCY", "8"))
+FETCH_TIMEOUT = float(os.environ.get("FETCH_TIMEOUT", "20"))
+FETCH_MAX_TRIES = int(os.environ.get("FETCH_MAX_TRIES", "5"))
+
+RACERESULT_URL = "https://my.raceresult.com/{event_id}/RRPublish/data/{endpoint}"
+
+# (etag, last-modified, gzipped body) per request url without the rotating "key" token, i.e. one entry per event
+# and list, kept across warm invocations for conditional requests
+_conditional_cache: dict[str, tuple[str | None, str | None, bytes]] = {}
+
+
+def is_client_error(exception: Exception) -> bool:
+    return isinstance(exception, httpx.HTTPStatusError) and exception.response.status_code < 500
+
+
+# top-level JSON whitespace, see decode_list_response()
+_json_whitespace = re.compile(r"[ \t\n\r]*")
+
+
+def decode_list_response(body: bytes) -> ParticipantListResponse:
+    """
+    Decode a participant list response, keeping every category of its `data` mapping as canonical JSON bytes.
+
+    The categories are decoded one at a time and encoded again right away, so a large list is never held as
+    Python objects all at once (about four times its size). The bytes hash and store as the rows they encode,
+    decode_rows() turns them back into rows where a category is processed.
+    """
+    text = body.decode()
+    decode, skip = json.JSONDecoder().raw_decode, _json_whitespace.match
+
+    def decode_object(index: int, decode_member: typing.Callable[[str, int], tuple[typing.Any, int]]):
+        """Decode the object at `index` member by member, returning it with the index after it."""
+        members = {}
+        index = skip(text, index + 1).end()
+        if text.startswith("}", index):
+            return members, index + 1
+        while True:
+            key, index = decode(text, index)
+            index = skip(text, index).end()
+            if not text.startswith(":", index):
+                raise json.JSONDecodeError("Expecting ':' delimiter", text, index)
+            members[key], index = decode_member(key, skip(text, index + 1).end())
+            index = skip(text, index).end()
+            if text.startswith("}", index):
+                return members, index + 1
+            if not text.startswith(",", index):
+                raise json.JSONDecodeError("Expecting ',' delimiter", text, index)
+            index = skip(text, index + 1).end()
+
+    def decode_category(category: str, index: int) -> tuple[typing.Any, int]:
+        rows, index = decode(text, index)
+        return (canonical_json(rows) if isinstance(rows, list) else rows), index
+
+    def decode_member(key: str, index: int) -> tuple[typing.Any, int]:
+        if key == "data" and text.startswith("{", index):
+            return decode_object(index, decode_category)
+        return decode(text, index)
+
+    start = skip(text).end()
+    if not text.startswith("{", start):
+        return json.loads(text)
+    response, end = decode_object(start, decode_member)
+    if skip(text, end).end() != len(text):
+        raise json.JSONDecodeError("Extra data", text, end)
+    return response
+
+
+def decode_rows(rows: list[list[str]] | bytes) -> list[list[str]]:
+    """Rows of a participant list category, decoding the canonical JSON kept by decode_list_response()."""
+    return json.loads(rows) if isinstance(rows, bytes) else rows
+
+
+async def _get_json(
+    client: httpx.AsyncClient,
+    url: str,
+    params: dict[str, str],
+    decode: typing.Callable[[bytes], typing.Any] = json.loads,
+) -> typing.Any:
+    cache_key = str(httpx.URL(url, params={name: value for name, value in params.items() if name != "key"}))
+    etag, last_modified, cached_body = _conditional_cache.get(cache_key, (None, None, b""))
+    headers = {}
+    if etag:
+        headers["if-none-match"] = etag
+    if last_modified:
+        headers["if-modified-since"] = last_modified
+
+    with timed("fetch", params.get("listname", url.rsplit("/", 1)[-1])) as counts:
+        response = await client.get(url, params=params, headers=headers)
+        counts["bytes"] = len(response.content)
+    if response.status_code == 304 and cache_key in _conditional_cache:
+        return decode(gzip.decompress(cached_body))
+    response.raise_for_status()
+
+    if "etag" in response.headers or "last-modified" in response.headers:
+        compressed = gzip.compress(response.content, compresslevel=1)
+        _conditional_cache[cache_key] = (
+            response.headers.get("etag"),
+            response.headers.get("last-modified"),
+            compressed,
+        )
+    else:
+        _conditional_cache.pop(cache_key, None)
+    return decode(response.content)
+
+
+async def get_json(
+    client: httpx.AsyncClient,
+    url: str,
+    params: dict[str, str],
+    decode: typing.Callable[[bytes], typing.Any] = json.loads,
+) -> typing.Any:
+    """GET `url` and `decode` its JSON body, retrying network errors and 5xx responses with exponential backoff."""
+    retrying = backoff.on_exception(
+        backoff.expo,
+        (httpx.RequestError, httpx.HTTPStatusError),
+        max_tries=FETCH_MAX_TRIES,
+        giveup=is_client_error,
+    )(_get_json)
+    return await retrying(client, url, params, decode)
+
+
+def raceresult_client(event: EventConfig, transport: httpx.AsyncBaseTransport | None = None) -> httpx.AsyncClient:
+    """HTTP client sending the browser headers raceresult expects from `event`'s site."""
     headers = {
         "accept": "*/*",
         "accept-language": "en-US,en;q=0.9",
         "cache-control": "no-cache",
         "dnt": "1",
-        "origin": "https://zurichcitytriathlon.ch",
+        "origin": event["origin"],
         "pragma": "no-cache",
         "priority": "u=1, i",
-        "referer": "https://zurichcitytriathlon.ch/",
+        "referer": f"{event['origin']}/",
         "sec-ch-ua": '"Google Chrome";v="129", "Not=A?Brand";v="8", "Chromium";v="129"',
         "sec-ch-ua-mobile": "?0",
         "sec-ch-ua-platform": '"Windows"',
@@ -87,62 +740,197 @@ def fetch_athlete_data() -> tuple[ConfigResponse, dict[str, ParticipantListRespo
         "sec-fetch-site": "cross-site",
         "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36",
     }
+    return httpx.AsyncClient(http2=True, headers=headers, timeout=FETCH_TIMEOUT, transport=transport)
+
 
-    config_url = "https://my.raceresult.com/307885/RRPublish/data/config"
+async def fetch_athlete_data_async(
+    event: EventConfig, transport: httpx.AsyncBaseTransport | None = None
+) -> tuple[ConfigResponse, dict[str, ParticipantListResponse], dict[str, float]]:
+    """Fetch the config and then every participant list of `event` concurrently, with per-request latencies."""
+    config_url = RACERESULT_URL.format(event_id=event["event_id"], endpoint="config")
     config_params = {"page": "participants", "noVisitor": "1"}
 
-    list_url = "https://my.raceresult.com/307885/RRPublish/data/list"
+    list_url = RACERESULT_URL.format(event_id=event["event_id"], endpoint="list")
     list_params = {
-        "key": "4e6f7163c82a088408a57645785fd923",
-        "listname": "000-Startlists|Waitlist",
         "page": "participants",
         "contest": "0",
         "r": "all",
         "l": "0",
     }
 
-    with httpx.Client(http2=True, headers=headers) as client:
-        config_response = client.get(config_url, params=config_params)
-        config_response.raise_for_status()
-        config_data: ConfigResponse = config_response.json()
-
-        participant_lists: dict[str, ParticipantListResponse] = {}
-        with ThreadPoolExecutor() as executor:
-            futures = {}
-            for list_entry in config_data["lists"]:
-                params = {**list_params, "listname": list_entry["Name"], "key": config_data["key"]}
-                futures[list_entry["Name"]] = executor.submit(lambda p: client.get(list_url, params=p).json(), params)
-
-            for name, future in futures.items():
-                response = future.result()
-                participant_lists[name] = response
-
-        return config_data, participant_lists
-
-
-def process_athlete_data(athlete_list_per_category: dict[str, list[str]]) -> pd.DataFrame:
-    athlete_rows_lists_per_category = [
-        [(*athlete, category) for athlete in athletes] for category, athletes in athlete_list_per_category.items()
-    ]
-    athlete_rows = itertools.chain(*athlete_rows_lists_per_category)
-
-    # fmt: off
-    columns = [
-        "bib", "contest", "name", "gender", "start", "age_group", "club",
-        "company", "flag_icon", "country", "year_born", "contest_category"
-    ]
-    # fmt: on
-
-    df = pd.DataFrame(athlete_rows, columns=columns).drop(columns="flag_icon")
-
-    df = df.replace({None: pd.NA, "": pd.NA})
-    df = df.map(lambda v: v.strip() if isinstance(v, str) else v).replace("", pd.NA)
+    latencies: dict[str, float] = {}
+    semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+    async def timed_get_json(
+        name: str, url: str, params: dict[str, str], decode: typing.Callable[[bytes], typing.Any] = json.loads
+    ) -> typing.Any:
+        async with semaphore:
+            started = time.perf_counter()
+            body = await get_json(client, url, params, decode)
+            latencies[name] = time.perf_counter() - started
+            return body
+
+    async with raceresult_client(event, transport) as client:
+        config_data: ConfigResponse = await timed_get_json("config", config_url, config_params)
+
+        names = [list_entry["Name"] for list_entry in config_data["lists"]]
+        responses = await asyncio.gather(
+            *(
+                timed_get_json(
+                    name,
+                    list_url,
+                    {**list_params, "listname": name, "key": config_data["key"]},
+                    decode_list_response,
+                )
+                for name in names
+            )
+        )
+        participant_lists: dict[str, ParticipantListResponse] = dict(zip(names, responses))
+
+    return config_data, participant_lists, latencies
+
+
+def fetch_athlete_data(
+    event: EventConfig, transport: httpx.AsyncBaseTransport | None = None
+) -> tuple[ConfigResponse, dict[str, ParticipantListResponse]]:
+    config_data, participant_lists, latencies = asyncio.run(fetch_athlete_data_async(event, transport))
+    logger.info("fetch latencies: %s", {name: round(latency, 3) for name, latency in latencies.items()})
+    return config_data, participant_lists
+
+
+def fetch_events(
+    events: list[EventConfig], transport: httpx.AsyncBaseTransport | None = None
+) -> list[tuple[ConfigResponse, dict[str, ParticipantListResponse], float] | Exception]:
+    """Fetch all `events` concurrently, returning (config, lists, seconds) or the exception per event."""
+
+    async def timed_fetch(event: EventConfig):
+        _metrics_event_id.set(event["event_id"])
+        started = time.perf_counter()
+        config_data, participant_lists, latencies = await fetch_athlete_data_async(event, transport)
+        logger.info("event %s fetch latencies: %s", event["event_id"], {k: round(v, 3) for k, v in latencies.items()})
+        return config_data, participant_lists, time.perf_counter() - started
+
+    async def fetch_all():
+        return await asyncio.gather(*(timed_fetch(event) for event in events), return_exceptions=True)
+
+    return asyncio.run(fetch_all())
+
+
+def replay_transport(recordings: dict[int, list[Recording]]) -> httpx.MockTransport:
+    """
+    Transport answering raceresult requests from recorded responses per event id.
+
+    Every config and list request takes the next recording of its event, the last one keeps being served,
+    so a sequence of recordings replays how the data changed over time.
+    """
+    served: dict[tuple[int, str], int] = {}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        event_id = int(request.url.path.split("/")[1])
+        name = request.url.params.get("listname", "config")
+        event_recordings = recordings.get(event_id)
+        if not event_recordings:
+            return httpx.Response(404)
+        index = served[event_id, name] = served.get((event_id, name), -1) + 1
+        recording = event_recordings[min(index, len(event_recordings) - 1)]
+        if name == "config":
+            return httpx.Response(200, json=recording["config"])
+        if name not in recording["lists"]:
+            return httpx.Response(404)
+        return httpx.Response(200, json=recording["lists"][name])
+
+    return httpx.MockTransport(handler)
+
+
+@functools.cache
+def compile_list_schema(schema_name: str, data_fields: tuple[str, ...] | None = None) -> dict[str, int | None]:
+    """
+    Row position of every kept column of `LIST_SCHEMAS[schema_name]`, None for columns the list does not have.
+
+    Without `data_fields` the schema's positional layout is used, otherwise columns are matched by field name
+    (case-insensitive), so reordered or added raceresult fields neither shift nor break the output.
+    """
+    schema = LIST_SCHEMAS[schema_name]
+    if data_fields is None:
+        positions = {column: i for i, column in enumerate(schema["columns"])}
+    else:
+        field_positions = {field.casefold(): i for i, field in reversed(list(enumerate(data_fields)))}
+        positions = {
+            column: next(
+                (field_positions[f.casefold()] for f in [column, *fields] if f.casefold() in field_positions), None
+            )
+            for column, fields in schema["fields"].items()
+        }
+        unmapped = sorted(set(data_fields) - {data_fields[i] for i in positions.values() if i is not None})
+        if unmapped:
+            logger.info("list schema %s ignores fields %s", schema_name, unmapped)
+    return {column: positions.get(column) for column in schema["columns"] if column not in schema["drop"]}
+
+
+def build_frame(
+    athlete_list_per_category: dict[str, list[list[str]] | bytes],
+    positions: dict[str, int | None],
+    category_column: str,
+    categorical: typing.Collection[str] = (),
+) -> pd.DataFrame:
+    """
+    Build a frame from the per-category rows one column at a time, without per-row tuples.
+
+    `positions` maps each output column to its row position (see compile_list_schema), other fields are never
+    materialized. Categories kept as bytes are decoded one at a time and each is dropped once its columns are
+    taken, so only the kept fields outlive it. The `categorical` columns and the category column are returned as
+    Categoricals.
+    """
+    parts: dict[str, list[np.ndarray]] = {column: [] for column, i in positions.items() if i is not None}
+    sizes: dict[str, int] = {}
+    for category, athletes in athlete_list_per_category.items():
+        athletes = decode_rows(athletes)
+        sizes[category] = len(athletes)
+        width = min(map(len, athletes), default=0)
+        for column, column_parts in parts.items():
+            i = positions[column]
+            # short rows leave the trailing columns as None, like the row-wise constructor did
+            values = (
+                map(operator.itemgetter(i), athletes) if i < width else (a[i] if i < len(a) else None for a in athletes)
+            )
+            column_parts.append(np.fromiter(values, dtype=object, count=len(athletes)))
+        del athletes
+
+    total = sum(sizes.values())
+    data = {
+        column: np.concatenate(parts[column]) if parts.get(column) else np.full(total, None, dtype=object)
+        for column in positions
+    }
+    for column in categorical:
+        data[column] = pd.Categorical(data[column])
+    categories = [category for category, size in sizes.items() if size]
+    data[category_column] = pd.Categorical.from_codes(
+        np.repeat(np.arange(len(categories)), [sizes[category] for category in categories]), categories
+    )
+    return pd.DataFrame(data, copy=False)
+
+
+def extract_list(
+    athlete_list_per_category: dict[str, list[list[str]] | bytes],
+    schema_name: str,
+    data_fields: list[str] | None = None,
+) -> pd.DataFrame:
+    """Raw string frame of a participant list laid out by `LIST_SCHEMAS[schema_name]`."""
+    schema = LIST_SCHEMAS[schema_name]
+    positions = compile_list_schema(schema_name, None if data_fields is None else tuple(data_fields))
+    return build_frame(athlete_list_per_category, positions, schema["category_column"], schema["categorical"])
+
+
+def process_athlete_data(
+    athlete_list_per_category: dict[str, list[str]], data_fields: list[str] | None = None
+) -> pd.DataFrame:
+    df = extract_list(athlete_list_per_category, "athletes", data_fields)
+    df = strip_strings(df)
 
     df["bib"] = df["bib"].astype("Int64")
-    df["contest_category_id"] = df["contest_category"].str.extract(r"#(\d+)_")[0].astype("Int64")
-    df["contest_category"] = df["contest_category"].str.extract(r"_(.*)")[0]
-    df["contest_category"] = df["contest_category"].map(get_english_translation)
-    df["name"] = df["name"].fillna("").map(string.capwords).replace("", pd.NA)
+    df["contest_category_id"], df["contest_category"] = split_contest_category(df["contest_category"])
+    df["contest_category"] = map_categories(df["contest_category"], lambda names: names.map(get_english_translation))
+    df["name"] = capwords(df["name"])
 
     gender_mapping = {
         "M": "Male",
@@ -151,41 +939,34 @@ def process_athlete_data(athlete_list_per_category: dict[str, list[str]]) -> pd.
         "Weiblich": "Female",
         "Mixed": "Mixed",
     }
-    df["gender"] = df["gender"].map(gender_mapping).fillna(df["gender"])
+    df["gender"] = map_categories(df["gender"], lambda genders: genders.map(gender_mapping).fillna(genders))
 
     invalid_clubs = [",  ,", "-", "NONE", "N/A", "KEIN VEREIN"]
-    df.loc[df["club"].str.upper().isin(invalid_clubs), "club"] = pd.NA
+    df["club"] = map_categories(df["club"], lambda clubs: clubs.mask(clubs.str.upper().isin(invalid_clubs)))
 
-    df["country"] = df["country"].replace({pd.NA: ""})
-    df["country"] = cc.pandas_convert(series=df["country"], src="IOC", to="name_short", not_found=None)
-    df["country"] = cc.pandas_convert(series=df["country"], src="ISO3", to="name_short", not_found=None)
-    df["country"] = df["country"].replace({"": pd.NA})
+    df["country"] = map_categories(df["country"], convert_countries)
 
     df["year_born"] = pd.to_numeric(df["year_born"], errors="coerce").astype("Int64")
+    # stored as smallint, anything outside it is not a year
+    df.loc[df["year_born"].abs() >= 2**15, "year_born"] = pd.NA
     df["age"] = datetime.datetime.now().year - df["year_born"]
 
     return df
 
 
-def process_wait_list_athlete_data(athlete_list_per_category: dict[str, list[str]]) -> pd.DataFrame:
-    athlete_rows = [
-        [(*athlete, category) for athlete in athletes] for category, athletes in athlete_list_per_category.items()
-    ]
-    columns = ["autorank", "id", "autorank2", "name", "gender", "age_group", "flag_icon", "country", "contest_category"]
-    df = pd.DataFrame(itertools.chain(*athlete_rows), columns=columns)
-    df = df.drop(columns="flag_icon")  # .drop(columns="autorank2")
-
-    df = df.replace({None: pd.NA, "": pd.NA})
-    df = df.map(lambda v: v.strip() if isinstance(v, str) else v).replace("", pd.NA)
+def process_wait_list_athlete_data(
+    athlete_list_per_category: dict[str, list[str]], data_fields: list[str] | None = None
+) -> pd.DataFrame:
+    df = extract_list(athlete_list_per_category, "wait_list", data_fields)
+    df = strip_strings(df)
 
     df["autorank"] = df["autorank"].astype("Int64")
     df["id"] = df["id"].astype("Int64")
     df["autorank2"] = df["autorank2"].astype("Int64")
 
-    df["contest_category_id"] = df["contest_category"].str.extract(r"#(\d+)_")[0].astype("Int64")
-    df["contest_category"] = df["contest_category"].str.extract(r"_(.*)")[0]
+    df["contest_category_id"], df["contest_category"] = split_contest_category(df["contest_category"])
 
-    df["name"] = df["name"].fillna("").map(string.capwords).replace("", pd.NA)
+    df["name"] = capwords(df["name"])
 
     gender_mapping = {
         "M": "Male",
@@ -194,12 +975,9 @@ def process_wait_list_athlete_data(athlete_list_per_category: dict[str, list[str
         "Weiblich": "Female",
         "Mixed": "Mixed",
     }
-    df["gender"] = df["gender"].map(gender_mapping).fillna(df["gender"])
+    df["gender"] = map_categories(df["gender"], lambda genders: genders.map(gender_mapping).fillna(genders))
 
-    df["country"] = df["country"].replace({pd.NA: ""})
-    df["country"] = cc.pandas_convert(series=df["country"], src="IOC", to="name_short", not_found=None)
-    df["country"] = cc.pandas_convert(series=df["country"], src="ISO3", to="name_short", not_found=None)
-    df["country"] = df["country"].replace({"": pd.NA})
+    df["country"] = map_categories(df["country"], convert_countries)
 
     return df
 
@@ -225,7 +1003,383 @@ def process_splits_data(config_data: ConfigResponse) -> pd.DataFrame:
     return splits_df
 
 
+def process_contest_categories_data(config_data: ConfigResponse) -> pd.DataFrame:
+    contest_categories_df = pd.DataFrame(config_data["contests"].items(), columns=["id", "name"])
+    contest_categories_df["name"] = contest_categories_df["name"].map(get_english_translation)
+    contest_categories_df["id"] = contest_categories_df["id"].astype("Int64")
+    return contest_categories_df
+
+
+class ValidationError(ValueError):
+    """A processed table failed its VALIDATION_CHECKS."""
+
+
+def known_countries() -> set[str]:
+    """Names country codes were resolved to so far, codes country_converter does not know resolve to themselves."""
+    with _country_names_lock:
+        return {name for code, name in get_country_names().items() if name != code}
+
+
+def failing_rows(df: pd.DataFrame, check: ValidationCheck) -> np.ndarray:
+    """Mask of the rows of `df` breaking `check`, missing values only break "unique" and "range" never."""
+    if check["rule"] == "unique":
+        failing = df.duplicated(check["columns"]) & df[check["columns"]].notna().all(axis=1)
+        return failing.to_numpy(dtype=bool)
+
+    mask = np.zeros(len(df), dtype=bool)
+    for column in check["columns"]:
+        series = df[column]
+        if check["rule"] == "range":
+            failing = (series < check["min"]) | (series > check["max"])
+        elif check["rule"] == "values":
+            failing = series.notna() & ~series.isin(check["values"])
+        elif check["rule"] == "country":
+            failing = series.notna() & ~series.isin(known_countries())
+        else:
+            raise ValueError(f"unknown validation rule {check['rule']!r}")
+        mask |= failing.fillna(False).to_numpy(dtype=bool)
+    return mask
+
+
+def validate_table(table_name: str, df: pd.DataFrame, previous_rows: dict[int | None, int] | None = None) -> None:
+    """
+    Run the VALIDATION_CHECKS of `table_name` on `df`, raising ValidationError when one fails.
+
+    Every check is a column operation over the whole frame, `previous_rows` holds the previous run's row count per
+    contest_category_id of the categories in `df`'s scope (None when unknown).
+    """
+    results = []
+    for check in VALIDATION_CHECKS.get(table_name, []):
+        if check["rule"] != "row_count":
+            failing = int(failing_rows(df, check).sum())
+            description = f"{table_name}: {check['rule']} {', '.join(check['columns'])}: {failing} of {len(df)} rows"
+            results.append((check, failing, len(df), description))
+            continue
+        if not previous_rows:
+            continue
+        current_rows = {
+            None if pd.isna(category_id) else int(category_id): rows
+            for category_id, rows in df["contest_category_id"].value_counts(dropna=False).items()
+        }
+        for category_id, total in previous_rows.items():
+            if total < check.get("min_rows", 0):
+                continue
+            failing = max(total - current_rows.get(category_id, 0), 0)
+            description = (
+                f"{table_name}: {failing} of the previous run's {total} rows in contest category {category_id} are gone"
+            )
+            results.append((check, failing, total, description))
+
+    errors = []
+    for check, failing, total, description in results:
+        if not failing:
+            continue
+        if failing > check["tolerance"] * total:
+            errors.append(description)
+        else:
+            logger.warning("%s (within tolerance)", description)
+    if errors:
+        raise ValidationError("; ".join(errors))
+
+
+def canonical_chunks(value: typing.Any) -> typing.Iterator[bytes]:
+    """
+    Canonical JSON of `value` (sorted keys, no whitespace, UTF-8) in pieces.
+
+    bytes values are canonical JSON already (see decode_list_response) and are passed through as they are.
+    """
+    if isinstance(value, bytes):
+        yield value
+    elif isinstance(value, dict) and any(isinstance(item, (bytes, dict)) for item in value.values()):
+        separator = b"{"
+        for key, item in sorted(value.items()):
+            yield separator + json.dumps(key, ensure_ascii=False).encode() + b":"
+            yield from canonical_chunks(item)
+            separator = b","
+        yield b"{}" if separator == b"{" else b"}"
+    else:
+        yield json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def canonical_json(value: typing.Any) -> bytes:
+    return b"".join(canonical_chunks(value))
+
+
+def canonical_hash(value: typing.Any) -> str:
+    content_hash = hashlib.sha256()
+    for chunk in canonical_chunks(value):
+        content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def fingerprint_payload(
+    config_data: ConfigResponse, participant_lists: dict[str, ParticipantListResponse]
+) -> dict[str, str]:
+    """Content hash of the config, of every participant list and of every "<list>/<category>"."""
+    # the key is a request token, not content, and would make every config look changed
+    fingerprints = {"config": canonical_hash({k: v for k, v in config_data.items() if k != "key"})}
+    for list_name, response in participant_lists.items():
+        fingerprints[list_name] = canonical_hash(response)
+        data = response.get("data")
+        if isinstance(data, dict):
+            for category, rows in data.items():
+                fingerprints[f"{list_name}/{category}"] = canonical_hash(rows)
+    return fingerprints
+
+
+def load_fingerprints(connection: Connection) -> dict[int, dict[str, str]]:
+    """Previous fingerprints per event id, empty when there are none or they predate event ids."""
+    inspector = sqlalchemy.inspect(connection)
+    if not inspector.has_table("dataset_fingerprints"):
+        return {}
+    if "event_id" not in {column["name"] for column in inspector.get_columns("dataset_fingerprints")}:
+        return {}
+
+    fingerprints: dict[int, dict[str, str]] = {}
+    rows = connection.execute(sqlalchemy.text('SELECT event_id, name, content_hash FROM "dataset_fingerprints"'))
+    for event_id, name, content_hash in rows:
+        fingerprints.setdefault(event_id, {})[name] = content_hash
+    return fingerprints
+
+
+def load_row_counts(connection: Connection) -> dict[int, dict[str, dict[int | None, int]]]:
+    """Rows per event id, table and contest_category_id of the tables with a row_count check."""
+    inspector = sqlalchemy.inspect(connection)
+    counts: dict[int, dict[str, dict[int | None, int]]] = {}
+    for table_name, checks in VALIDATION_CHECKS.items():
+        if not any(check["rule"] == "row_count" for check in checks) or not inspector.has_table(table_name):
+            continue
+        if not {"event_id", "contest_category_id"} <= {column["name"] for column in inspector.get_columns(table_name)}:
+            continue
+        rows = connection.execute(
+            sqlalchemy.text(f'SELECT event_id, contest_category_id, count(*) FROM "{table_name}" GROUP BY 1, 2')
+        )
+        for event_id, category_id, row_count in rows:
+            counts.setdefault(event_id, {}).setdefault(table_name, {})[category_id] = row_count
+    return counts
+
+
+def changed_categories(
+    list_name: str, data: dict[str, list[str]], previous: dict[str, str], fingerprints: dict[str, str]
+) -> tuple[dict[str, list[str]], list[int] | None]:
+    """
+    Pick the categories of `list_name` that need reprocessing.
+
+    Returns the subset of `data` to process and the contest_category_ids it covers, or all of `data`
+    and None when the list has no usable previous fingerprint and must be reloaded whole.
+    """
+    if list_name not in previous:
+        return data, None
+
+    prefix = f"{list_name}/"
+    changed = {
+        name.removeprefix(prefix)
+        for name in fingerprints.keys() | previous.keys()
+        if name.startswith(prefix) and fingerprints.get(name) != previous.get(name)
+    }
+    matches = [re.search(r"#(\d+)_", category) for category in changed]
+    if not all(matches):
+        return data, None
+
+    # categories sharing an id with a changed one are reloaded too, the delete is scoped by id
+    category_ids = sorted({int(match.group(1)) for match in matches})
+    subset = {
+        category: rows
+        for category, rows in data.items()
+        if (match := re.search(r"#(\d+)_", category)) and int(match.group(1)) in category_ids
+    }
+    return subset, category_ids
+
+
+def count_rows(connection: Connection, table_name: str, event_id: int) -> int:
+    if not sqlalchemy.inspect(connection).has_table(table_name):
+        return 0
+    query = sqlalchemy.text(f'SELECT count(*) FROM "{table_name}" WHERE event_id = :event_id')
+    return connection.execute(query, {"event_id": event_id}).scalar_one()
+
+
+def record_heartbeat(connection: Connection, event_id: int, used_data_hash: str) -> None:
+    """Repeat the event's last dataset update for a run that found no upstream changes."""
+    connection.execute(
+        sqlalchemy.text(
+            """
+            INSERT INTO "dataset_update_events"
+                (created_at, event_id, used_data_hash, athletes_count, athletes_wait_list_count)
+            SELECT :created_at, event_id, :used_data_hash, athletes_count, athletes_wait_list_count
+            FROM "dataset_update_events" WHERE event_id = :event_id ORDER BY created_at DESC LIMIT 1
+            """
+        ),
+        {"created_at": datetime.datetime.now(datetime.UTC), "event_id": event_id, "used_data_hash": used_data_hash},
+    )
+
+
+def ensure_audit_schema(connection: Connection) -> None:
+    connection.execute(
+        sqlalchemy.text(
+            """
+            CREATE TABLE IF NOT EXISTS "raw_snapshots" (
+                content_hash text PRIMARY KEY,
+                encoding text NOT NULL,
+                payload bytea NOT NULL,
+                raw_size integer NOT NULL,
+                created_at timestamptz NOT NULL DEFAULT now()
+            )
+            """
+        )
+    )
+    if sqlalchemy.inspect(connection).has_table("dataset_update_events"):
+        connection.execute(
+            sqlalchemy.text(
+                """
+                ALTER TABLE "dataset_update_events"
+                    ADD COLUMN IF NOT EXISTS event_id bigint,
+                    ADD COLUMN IF NOT EXISTS used_data_hash text
+                """
+            )
+        )
+
+
+def store_snapshot(connection: Connection, value: typing.Any, content_hash: str | None = None) -> str:
+    """
+    Store `value` as gzipped canonical JSON in raw_snapshots unless already there, returning its hash.
+
+    A known `content_hash` (the canonical_hash of `value`, e.g. its fingerprint) skips serializing `value` when
+    the snapshot is already stored.
+    """
+    payload = None
+    if content_hash is None:
+        payload = canonical_json(value)
+        content_hash = hashlib.sha256(payload).hexdigest()
+    exists = connection.execute(
+        sqlalchemy.text('SELECT 1 FROM "raw_snapshots" WHERE content_hash = :content_hash'),
+        {"content_hash": content_hash},
+    ).first()
+    if not exists:
+        if payload is None:
+            payload = canonical_json(value)
+        connection.execute(
+            sqlalchemy.text(
+                """
+                INSERT INTO "raw_snapshots" (content_hash, encoding, payload, raw_size)
+                VALUES (:content_hash, 'gzip', :payload, :raw_size)
+                ON CONFLICT (content_hash) DO NOTHING
+                """
+            ),
+            {"content_hash": content_hash, "payload": gzip.compress(payload), "raw_size": len(payload)},
+        )
+    return content_hash
+
+
+def load_snapshot(connection: Connection, content_hash: str) -> typing.Any:
+    encoding, payload = connection.execute(
+        sqlalchemy.text('SELECT encoding, payload FROM "raw_snapshots" WHERE content_hash = :content_hash'),
+        {"content_hash": content_hash},
+    ).one()
+    if encoding != "gzip":
+        raise ValueError(f"unsupported snapshot encoding {encoding!r}")
+    return json.loads(gzip.decompress(payload))
+
+
+def store_raw_payload(
+    connection: Connection,
+    config_data: ConfigResponse,
+    participant_lists: dict[str, ParticipantListResponse],
+    fingerprints: dict[str, str] | None = None,
+) -> str:
+    """
+    Store the fetched payload as one snapshot per list plus a manifest of their hashes, returning the manifest hash.
+
+    The lists' `fingerprints` (see fingerprint_payload) are their snapshot hashes, so unchanged lists are not
+    serialized again.
+    """
+    fingerprints = fingerprints or {}
+    manifest = {
+        "config_data": store_snapshot(connection, config_data),
+        "participant_lists": {
+            name: store_snapshot(connection, response, fingerprints.get(name))
+            for name, response in participant_lists.items()
+        },
+    }
+    return store_snapshot(connection, manifest)
+
+
+def load_raw_payload(connection: Connection, used_data_hash: str) -> dict[str, typing.Any]:
+    """Rebuild the {"config_data", "participant_lists"} payload of a dataset update event."""
+    manifest = load_snapshot(connection, used_data_hash)
+    return {
+        "config_data": load_snapshot(connection, manifest["config_data"]),
+        "participant_lists": {
+            name: load_snapshot(connection, content_hash)
+            for name, content_hash in manifest["participant_lists"].items()
+        },
+    }
+
+
+# the only event ingested before events.json, dataset update events from then have no event_id
+LEGACY_EVENT_ID = 307885
+
+
+def migrate_used_data(connection: Connection, batch_size: int = 50) -> dict[str, int]:
+    """
+    Move the inline used_data JSON of past events into raw_snapshots, returning the bytes before and after.
+
+    Events without an event_id are assigned LEGACY_EVENT_ID.
+    """
+    ensure_audit_schema(connection)
+    stats = {"events": 0, "inline_bytes": 0, "snapshot_bytes_before": 0, "snapshot_bytes_after": 0}
+    stats["event_ids"] = connection.execute(
+        sqlalchemy.text('UPDATE "dataset_update_events" SET event_id = :event_id WHERE event_id IS NULL'),
+        {"event_id": LEGACY_EVENT_ID},
+    ).rowcount
+    snapshot_bytes = sqlalchemy.text('SELECT coalesce(sum(octet_length(payload)), 0) FROM "raw_snapshots"')
+    stats["snapshot_bytes_before"] = connection.execute(snapshot_bytes).scalar_one()
+
+    while rows := connection.execute(
+        sqlalchemy.text(
+            """
+            SELECT ctid::text, used_data FROM "dataset_update_events"
+            WHERE used_data IS NOT NULL LIMIT :batch_size
+            """
+        ),
+        {"batch_size": batch_size},
+    ).all():
+        for ctid, used_data in rows:
+            payload = json.loads(used_data)
+            used_data_hash = store_raw_payload(connection, payload["config_data"], payload["participant_lists"])
+            connection.execute(
+                sqlalchemy.text(
+                    """
+                    UPDATE "dataset_update_events" SET used_data = NULL, used_data_hash = :used_data_hash
+                    WHERE ctid = CAST(:ctid AS tid)
+                    """
+                ),
+                {"ctid": ctid, "used_data_hash": used_data_hash},
+            )
+            stats["events"] += 1
+            stats["inline_bytes"] += len(used_data.encode())
+
+    stats["snapshot_bytes_after"] = connection.execute(snapshot_bytes).scalar_one()
+    saved = stats["inline_bytes"] - (stats["snapshot_bytes_after"] - stats["snapshot_bytes_before"])
+    logger.info("migrated %s events, saved %s bytes (VACUUM FULL reclaims them on disk)", stats["events"], saved)
+    return stats
+
+
+SETTINGS_TTL = float(os.environ.get("SETTINGS_TTL", "900"))
+# "host[:port]" of an RDS Proxy or PgBouncer in front of the database, used instead of the secret's host
+DB_POOLER_HOST = os.environ.get("DB_POOLER_HOST") or None
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", str(EVENT_WORKERS)))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+
+_settings: tuple[float, dict[str, str | int]] | None = None
+_engine: Engine | None = None
+
+
 def get_settings() -> dict[str, str | int]:
+    """Database credentials from Secrets Manager, fetched again once older than SETTINGS_TTL so rotations are seen."""
+    global _settings
+    if _settings is not None and time.monotonic() - _settings[0] < SETTINGS_TTL:
+        return _settings[1]
+
     # config = {
     #     "host": "localhost",
     #     "port": 5432,
@@ -240,56 +1394,1100 @@ def get_settings() -> dict[str, str | int]:
     client = boto3.client("secretsmanager")
     response = client.get_secret_value(SecretId=os.environ["SECRET_NAME"])
     secret = json.loads(response["SecretString"])
+    _settings = (time.monotonic(), secret)
     return secret
 
 
-def main():
-    config_data, participant_lists = fetch_athlete_data()
+def database_url(settings: dict[str, str | int]) -> sqlalchemy.URL:
+    """URL of the output database, through DB_POOLER_HOST when one is configured."""
+    host, _, port = (DB_POOLER_HOST or settings["host"]).partition(":")
+    if not DB_POOLER_HOST:
+        port = settings.get("port") or port
+    return sqlalchemy.URL.create(
+        drivername="postgresql+psycopg",
+        username=settings["username"],
+        password=settings["password"],
+        host=host,
+        port=int(port) if port else None,
+        database=settings["dbname"],
+    )
+
+
+def get_engine() -> Engine:
+    """Engine for the output database, kept across warm invocations so its pooled connections are reused.
+
+    Connections are pinged before use, since the server or a NAT may have dropped them while the Lambda was frozen,
+    and the pool is capped at DB_POOL_SIZE. A new engine replaces (and disposes) the cached one when the credentials
+    rotate. Behind a pooler psycopg's server-side prepared statements are turned off: transaction pooling PgBouncer
+    does not support them and RDS Proxy pins the client to one connection when it sees them.
+    """
+    global _engine
+    with timed("get_settings"):
+        settings = get_settings()
+    url = database_url(settings)
+    if _engine is not None and _engine.url == url:
+        return _engine
+    if _engine is not None:
+        _engine.dispose()
+    _engine = sqlalchemy.create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=0,
+        pool_pre_ping=True,
+        pool_recycle=DB_POOL_RECYCLE,
+        connect_args={"prepare_threshold": None} if DB_POOLER_HOST else {},
+    )
+    return _engine
+
+
+def ensure_keyed_table(connection: Connection, df: pd.DataFrame, table_name: str, keys: list[str]) -> None:
+    """Create `table_name` with a primary key on `keys` unless a table with the same columns and key exists."""
+    inspector = sqlalchemy.inspect(connection)
+    if inspector.has_table(table_name):
+        columns = [column["name"] for column in inspector.get_columns(table_name)]
+        primary_key = inspector.get_pk_constraint(table_name)["constrained_columns"]
+        if columns == list(df.columns) and primary_key == keys:
+            return
+        # legacy table created by to_sql(if_exists="replace") or the layout changed upstream
+        connection.execute(sqlalchemy.text(f'DROP TABLE "{table_name}"'))
+
+    df.head(0).to_sql(table_name, connection, index=False)
+    primary_key = ", ".join(f'"{key}"' for key in keys)
+    connection.execute(sqlalchemy.text(f'ALTER TABLE "{table_name}" ADD PRIMARY KEY ({primary_key})'))
+    migrate_table(connection, table_name)
+
+
+def ensure_lookup_tables(connection: Connection) -> None:
+    for lookup_name, columns in LOOKUP_TABLES.items():
+        definition = ", ".join(f'"{column}" {column_type} NOT NULL' for column, column_type in columns.items())
+        key_columns = ", ".join(f'"{column}"' for column in columns)
+        connection.execute(
+            sqlalchemy.text(f'CREATE TABLE IF NOT EXISTS "{lookup_name}" ({definition}, PRIMARY KEY ({key_columns}))')
+        )
+
+
+def migrate_table(connection: Connection, table_name: str) -> None:
+    """Bring an existing table to its managed column types, lookup foreign keys and indexes."""
+    inspector = sqlalchemy.inspect(connection)
+    columns = {column["name"]: column for column in inspector.get_columns(table_name)}
+    history_name = HISTORY_TABLES.get(table_name)
+    has_history = history_name is not None and inspector.has_table(history_name)
+    history_columns = {column["name"] for column in inspector.get_columns(history_name)} if has_history else set()
+
+    for column, column_type in TABLE_COLUMN_TYPES.get(table_name, {}).items():
+        if column in columns and columns[column]["type"].compile(dialect=connection.dialect).lower() != column_type:
+            for name in [table_name] + ([history_name] if column in history_columns else []):
+                connection.execute(
+                    sqlalchemy.text(
+                        f'ALTER TABLE "{name}" ALTER COLUMN "{column}" TYPE {column_type} USING "{column}"::{column_type}'
+                    )
+                )
+
+    if table_name in TABLE_LOOKUPS:
+        ensure_lookup_tables(connection)
+    foreign_keys = {foreign_key["referred_table"] for foreign_key in inspector.get_foreign_keys(table_name)}
+    for lookup_name in TABLE_LOOKUPS.get(table_name, []):
+        lookup_columns = list(LOOKUP_TABLES[lookup_name])
+        if lookup_name not in LOOKUP_FOREIGN_KEYS or lookup_name in foreign_keys:
+            continue
+        if not set(lookup_columns) <= columns.keys():
+            continue
+        key_columns = ", ".join(f'"{column}"' for column in lookup_columns)
+        not_null = " AND ".join(f'"{column}" IS NOT NULL' for column in lookup_columns)
+        for statement in (
+            f"""
+            INSERT INTO "{lookup_name}" ({key_columns})
+            SELECT DISTINCT {key_columns} FROM "{table_name}" WHERE {not_null}
+            ON CONFLICT DO NOTHING
+            """,
+            f"""
+            ALTER TABLE "{table_name}" ADD CONSTRAINT "{table_name}_{lookup_name}_fkey"
+            FOREIGN KEY ({key_columns}) REFERENCES "{lookup_name}" ({key_columns})
+            """,
+        ):
+            connection.execute(sqlalchemy.text(statement))
+
+    for index_columns in TABLE_INDEXES.get(table_name, []):
+        if set(index_columns) <= columns.keys():
+            index_name = "_".join([table_name, *index_columns, "idx"])
+            column_list = ", ".join(f'"{column}"' for column in index_columns)
+            connection.execute(
+                sqlalchemy.text(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ({column_list})')
+            )
+
+
+def migrate_schema(connection: Connection) -> None:
+    """Apply the managed DDL to every output table that exists, a no-op once applied."""
+    ensure_lookup_tables(connection)
+    inspector = sqlalchemy.inspect(connection)
+    for table_name in TABLE_COLUMN_TYPES.keys() | TABLE_INDEXES.keys():
+        if inspector.has_table(table_name):
+            migrate_table(connection, table_name)
+
+
+def ensure_lookup_values(connection: Connection, df: pd.DataFrame, table_name: str) -> None:
+    """Add the lookup keys of `df` that `table_name`'s foreign keys will reference."""
+    for lookup_name in TABLE_LOOKUPS.get(table_name, []):
+        lookup_columns = list(LOOKUP_TABLES[lookup_name])
+        if not set(lookup_columns) <= set(df.columns):
+            continue
+        if len(lookup_columns) == 1 and isinstance(df[lookup_columns[0]].dtype, pd.CategoricalDtype):
+            # the values in use are the categories, no need to look at the rows
+            categories = df[lookup_columns[0]].cat.remove_unused_categories().cat.categories
+            keys = pd.DataFrame({lookup_columns[0]: categories.astype(object)})
+        else:
+            keys = df[lookup_columns].dropna().drop_duplicates()
+        if keys.empty:
+            continue
+        key_columns = ", ".join(f'"{column}"' for column in lookup_columns)
+        placeholders = ", ".join(f":{column}" for column in lookup_columns)
+        connection.execute(
+            sqlalchemy.text(
+                f'INSERT INTO "{lookup_name}" ({key_columns}) VALUES ({placeholders}) ON CONFLICT DO NOTHING'
+            ),
+            keys.to_dict("records"),
+        )
 
-    # contests table
-    contest_categories_df = pd.DataFrame(config_data["contests"].items(), columns=["id", "name"])
-    contest_categories_df["name"] = contest_categories_df["name"].map(get_english_translation)
-    contest_categories_df["id"] = contest_categories_df["id"].astype("Int64")
 
-    # splits table
-    splits_df = process_splits_data(config_data)
+def copy_into_table(connection: Connection, df: pd.DataFrame, table_name: str, chunk_size: int = 50_000) -> int:
+    """Stream `df` into the existing table `table_name` with COPY, encoding pd.NA/None as NULL."""
+    columns = ", ".join(f'"{column}"' for column in df.columns)
+    sql = f"""COPY "{table_name}" ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"""
+
+    driver_connection = connection.connection.driver_connection
+    with driver_connection.cursor() as cursor, cursor.copy(sql) as copy:
+        for start in range(0, len(df), chunk_size):
+            chunk = df.iloc[start : start + chunk_size]
+            copy.write(chunk.to_csv(index=False, header=False, na_rep="\\N"))
+    return len(df)
+
+
+def insert_rows(connection: Connection, df: pd.DataFrame, table_name: str, writer: str) -> None:
+    if writer == "copy":
+        copy_into_table(connection, df, table_name)
+    else:
+        df.to_sql(table_name, connection, if_exists="append", index=False)
+
+
+def drop_null_keys(df: pd.DataFrame, table_name: str, keys: list[str]) -> tuple[pd.DataFrame, int]:
+    """Drop the rows of `df` that have no value in a key column, which the primary key of `table_name` rejects."""
+    missing = df[keys].isna().any(axis=1)
+    dropped = int(missing.sum())
+    if dropped:
+        logger.warning("%s: dropped %d of %d rows without %s", table_name, dropped, len(df), ", ".join(keys))
+        df = df[~missing]
+    return df, dropped
+
+
+def scope_filter(scope: dict[str, list[int]] | None, alias: str) -> tuple[str, dict[str, list[int]]]:
+    """SQL condition and parameters restricting `alias` to rows whose scope columns are in the given values."""
+    conditions, params = [], {}
+    for i, (column, values) in enumerate((scope or {}).items()):
+        conditions.append(f'AND {alias}."{column}" = ANY(:scope_{i})')
+        params[f"scope_{i}"] = values
+    return " ".join(conditions), params
+
+
+def upsert_table(
+    connection: Connection,
+    df: pd.DataFrame,
+    table_name: str,
+    keys: list[str],
+    writer: str = "to_sql",
+    scope: dict[str, list[int]] | None = None,
+) -> dict[str, int]:
+    """
+    Apply the difference between `df` and `table_name`, returning the inserted/updated/deleted/dropped row counts.
+
+    `scope` ({column: values}) limits the delete of missing keys to rows whose columns are in values, for
+    frames that only hold part of the table.
+    """
+    ensure_keyed_table(connection, df, table_name, keys)
+    df, dropped = drop_null_keys(df, table_name, keys)
+    ensure_lookup_values(connection, df, table_name)
+
+    stage_name = f"{table_name}_stage"
+    connection.execute(sqlalchemy.text(f'CREATE TEMP TABLE "{stage_name}" (LIKE "{table_name}") ON COMMIT DROP'))
+    insert_rows(connection, df, stage_name, writer)
+
+    columns = ", ".join(f'"{column}"' for column in df.columns)
+    key_columns = ", ".join(f'"{key}"' for key in keys)
+    keys_match = " AND ".join(f'stage."{key}" = target."{key}"' for key in keys)
+    values = [f'"{column}"' for column in df.columns if column not in keys]
+    assignments = ", ".join(f"{value} = EXCLUDED.{value}" for value in values)
+    current = ", ".join(f'"{table_name}".{value}' for value in values)
+    excluded = ", ".join(f"EXCLUDED.{value}" for value in values)
+
+    result = connection.execute(
+        sqlalchemy.text(
+            f"""
+            INSERT INTO "{table_name}" ({columns})
+            SELECT DISTINCT ON ({key_columns}) {columns} FROM "{stage_name}" ORDER BY {key_columns}
+            ON CONFLICT ({key_columns}) DO UPDATE SET {assignments}
+            WHERE ({current}) IS DISTINCT FROM ({excluded})
+            RETURNING (xmax = 0) AS inserted
+            """
+        )
+    )
+    upserted = result.scalars().all()
+
+    scope_conditions, scope_params = scope_filter(scope, "target")
+    deleted = connection.execute(
+        sqlalchemy.text(
+            f"""
+            DELETE FROM "{table_name}" AS target
+            WHERE NOT EXISTS (SELECT 1 FROM "{stage_name}" AS stage WHERE {keys_match})
+            {scope_conditions}
+            """
+        ),
+        scope_params,
+    ).rowcount
+    connection.execute(sqlalchemy.text(f'DROP TABLE "{stage_name}"'))
+
+    inserted = sum(upserted)
+    return {"inserted": inserted, "updated": len(upserted) - inserted, "deleted": deleted, "dropped": dropped}
+
+
+def replace_rows(
+    connection: Connection,
+    df: pd.DataFrame,
+    table_name: str,
+    keys: list[str],
+    writer: str = "to_sql",
+    scope: dict[str, list[int]] | None = None,
+) -> dict[str, int]:
+    """Delete the rows of `table_name` within `scope` and insert `df` in their place."""
+    ensure_keyed_table(connection, df, table_name, keys)
+    df, dropped = drop_null_keys(df, table_name, keys)
+    ensure_lookup_values(connection, df, table_name)
+    scope_conditions, scope_params = scope_filter(scope, "target")
+    deleted = connection.execute(
+        sqlalchemy.text(f'DELETE FROM "{table_name}" AS target WHERE true {scope_conditions}'), scope_params
+    ).rowcount
+    insert_rows(connection, df, table_name, writer)
+    return {"deleted": deleted, "inserted": len(df), "dropped": dropped}
+
+
+def ensure_history_table(connection: Connection, table_name: str, history_name: str, keys: list[str]) -> None:
+    """Create or extend `history_name` to hold every column of `table_name` plus valid_from/valid_to."""
+    inspector = sqlalchemy.inspect(connection)
+    if not inspector.has_table(history_name):
+        key_columns = ", ".join(f'"{key}"' for key in keys)
+        for statement in (
+            f'CREATE TABLE "{history_name}" (LIKE "{table_name}", valid_from timestamptz NOT NULL, valid_to timestamptz)',
+            f'ALTER TABLE "{history_name}" ADD PRIMARY KEY ({key_columns}, valid_from)',
+            f'CREATE INDEX ON "{history_name}" ({key_columns}) WHERE valid_to IS NULL',
+            f'CREATE INDEX ON "{history_name}" (event_id, valid_from, valid_to)',
+        ):
+            connection.execute(sqlalchemy.text(statement))
+        return
+
+    # columns added to the live table since the history table was created
+    history_columns = {column["name"] for column in inspector.get_columns(history_name)}
+    for column in inspector.get_columns(table_name):
+        if column["name"] not in history_columns:
+            column_type = column["type"].compile(dialect=connection.dialect)
+            connection.execute(
+                sqlalchemy.text(f'ALTER TABLE "{history_name}" ADD COLUMN "{column["name"]}" {column_type}')
+            )
+
+
+def update_history(
+    connection: Connection,
+    table_name: str,
+    keys: list[str],
+    valid_from: datetime.datetime,
+    scope: dict[str, list[int]] | None = None,
+) -> dict[str, int]:
+    """
+    Bring the SCD-2 history of `table_name` in line with its current rows within `scope`.
+
+    Open versions whose row changed or disappeared are closed at `valid_from`, and current rows without
+    an open version get a new one, so only changed rows are touched.
+    """
+    history_name = HISTORY_TABLES[table_name]
+    ensure_history_table(connection, table_name, history_name, keys)
+
+    columns = [column["name"] for column in sqlalchemy.inspect(connection).get_columns(table_name)]
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    current_values = ", ".join(f'current."{column}"' for column in columns)
+    history_values = ", ".join(f'history."{column}"' for column in columns)
+    keys_match = " AND ".join(f'current."{key}" = history."{key}"' for key in keys)
+    history_scope, history_params = scope_filter(scope, "history")
+    current_scope, current_params = scope_filter(scope, "current")
+
+    closed = connection.execute(
+        sqlalchemy.text(
+            f"""
+            UPDATE "{history_name}" AS history SET valid_to = :valid_from
+            WHERE history.valid_to IS NULL {history_scope}
+            AND NOT EXISTS (
+                SELECT 1 FROM "{table_name}" AS current
+                WHERE {keys_match} AND ({current_values}) IS NOT DISTINCT FROM ({history_values})
+            )
+            """
+        ),
+        {"valid_from": valid_from, **history_params},
+    ).rowcount
+    opened = connection.execute(
+        sqlalchemy.text(
+            f"""
+            INSERT INTO "{history_name}" ({column_list}, valid_from)
+            SELECT {current_values}, :valid_from FROM "{table_name}" AS current
+            WHERE true {current_scope}
+            AND NOT EXISTS (SELECT 1 FROM "{history_name}" AS history WHERE {keys_match} AND history.valid_to IS NULL)
+            """
+        ),
+        {"valid_from": valid_from, **current_params},
+    ).rowcount
+    return {"closed": closed, "opened": opened}
+
+
+def refresh_rollup(connection: Connection, table_name: str, event_id: int, hour: datetime.datetime) -> None:
+    """Store the event's athlete counts by contest_category/gender/country for the hour of `hour`."""
+    rollup_name = ROLLUP_TABLES[table_name]
+    for statement in (
+        f"""
+        CREATE TABLE IF NOT EXISTS "{rollup_name}" (
+            event_id bigint NOT NULL,
+            hour timestamptz NOT NULL,
+            contest_category text,
+            gender text,
+            country text,
+            athletes_count integer NOT NULL
+        )
+        """,
+        f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS "{rollup_name}_key"
+        ON "{rollup_name}" (event_id, hour, contest_category, gender, country) NULLS NOT DISTINCT
+        """,
+    ):
+        connection.execute(sqlalchemy.text(statement))
+
+    params = {"event_id": event_id, "hour": hour.replace(minute=0, second=0, microsecond=0)}
+    # groups that disappeared within the hour must not keep their earlier count
+    connection.execute(
+        sqlalchemy.text(f'DELETE FROM "{rollup_name}" WHERE event_id = :event_id AND hour = :hour'), params
+    )
+    connection.execute(
+        sqlalchemy.text(
+            f"""
+            INSERT INTO "{rollup_name}" (event_id, hour, contest_category, gender, country, athletes_count)
+            SELECT event_id, :hour, contest_category, gender, country, count(*)
+            FROM "{table_name}" WHERE event_id = :event_id
+            GROUP BY event_id, contest_category, gender, country
+            """
+        ),
+        params,
+    )
+
+
+def write_table(
+    connection: Connection,
+    df: pd.DataFrame,
+    table_name: str,
+    load_mode: str,
+    scope: dict[str, list[int]] | None = None,
+) -> dict[str, int]:
+    writer = TABLE_WRITERS.get(table_name, "to_sql")
+    load = replace_rows if load_mode == "replace" else upsert_table
+    with timed("write", table_name) as counts:
+        stats = load(connection, df, table_name, TABLE_KEYS[table_name], writer, scope)
+        counts["rows"] = len(df)
+    logger.info("%s: %s", table_name, stats)
+    return stats
+
+
+@functools.cache
+def get_process_executor() -> Executor:
+    """Executor for the pandas work of prepare_event, kept across warm invocations so workers start once."""
+    if PROCESS_WORKERS:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # fork would copy the locks of the event, fetch and connection pool threads in whatever state they are
+        return ProcessPoolExecutor(PROCESS_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+    return ThreadPoolExecutor(EVENT_WORKERS, thread_name_prefix="process")
+
+
+def process_table(
+    run_id: str | None,
+    event_id: int,
+    table_name: str,
+    previous_rows: dict[int | None, int] | None,
+    func: typing.Callable[..., pd.DataFrame],
+    *args,
+) -> tuple[pd.DataFrame, list[StageMetric]]:
+    """
+    Build `table_name` of an event with `func` and validate it, returning it with the metrics of its timed() stages.
+
+    Runs in an executor worker (possibly another process), so the metrics are collected here and merged into
+    the run by completed_tables(). A ValidationError fails the event before anything of it is committed.
+    """
+    metrics: list[StageMetric] = []
+    run_token = _run_metrics.set((run_id, metrics) if run_id is not None else None)
+    event_token = _metrics_event_id.set(event_id)
+    try:
+        with timed("process", table_name) as counts:
+            df = func(*args)
+            counts["rows"] = len(df)
+        with timed("validate", table_name) as counts:
+            validate_table(table_name, df, previous_rows)
+            counts["rows"] = len(df)
+    finally:
+        _metrics_event_id.reset(event_token)
+        _run_metrics.reset(run_token)
+    df.insert(0, "event_id", event_id)
+    return df, metrics
+
+
+def prepare_event(
+    event: EventConfig,
+    config_data: ConfigResponse,
+    participant_lists: dict[str, ParticipantListResponse],
+    previous: dict[str, str],
+    executor: Executor | None = None,
+    previous_counts: dict[str, dict[int | None, int]] | None = None,
+) -> EventUpdate:
+    """
+    Process the parts of an event's payload whose fingerprints differ from `previous`.
+
+    With an `executor` the tables are only submitted to it, load_event writes each one as it completes.
+    `previous_counts` (rows per table and contest_category_id, see load_row_counts) feed the row count checks of
+    the categories in each table's scope.
+    """
+    with timed("fingerprint"):
+        fingerprints = fingerprint_payload(config_data, participant_lists)
+    update: EventUpdate = {
+        "event": event,
+        "config_data": config_data,
+        "participant_lists": participant_lists,
+        "fingerprints": fingerprints,
+        "tables": None,
+    }
+    if fingerprints == previous:
+        return update
+
+    event_scope = {"event_id": [event["event_id"]]}
+    tables = update["tables"] = {}
+
+    run = _run_metrics.get()
+    run_id = run[0] if run is not None else None
+
+    def process(
+        table_name: str, scope: dict[str, list[int]], func: typing.Callable[..., pd.DataFrame], *args
+    ) -> Future:
+        previous_rows = None
+        if previous_counts is not None and table_name in previous_counts:
+            category_ids = scope.get("contest_category_id")
+            previous_rows = {
+                category_id: rows
+                for category_id, rows in previous_counts[table_name].items()
+                if category_ids is None or category_id in category_ids
+            }
+        args = run_id, event["event_id"], table_name, previous_rows, func, *args
+        if executor is not None:
+            return executor.submit(process_table, *args)
+        future: Future = Future()
+        future.set_result(process_table(*args))
+        return future
+
+    # contests and splits tables
+    if fingerprints["config"] != previous.get("config"):
+        tables["contest_categories_df"] = (
+            process("contest_categories_df", event_scope, process_contest_categories_data, config_data),
+            event_scope,
+        )
+        tables["splits_df"] = process("splits_df", event_scope, process_splits_data, config_data), event_scope
 
     # athletes table
-    athlete_df = process_athlete_data(participant_lists["000-Startlists|Startlist"]["data"])
+    startlist, category_ids = changed_categories(
+        event["startlist"], participant_lists[event["startlist"]]["data"], previous, fingerprints
+    )
+    # an empty subset with category ids still runs, so the scoped delete removes categories that are gone
+    if category_ids is None or category_ids:
+        scope = event_scope if category_ids is None else {**event_scope, "contest_category_id": category_ids}
+        data_fields = participant_lists[event["startlist"]].get("DataFields")
+        tables["athletes_df"] = process("athletes_df", scope, process_athlete_data, startlist, data_fields), scope
 
     # athletes_wait_list table
-    wait_list_data = participant_lists.get("000-Startlists|Waitlist")
-    athletes_wait_list_df = process_wait_list_athlete_data(wait_list_data["data"]) if wait_list_data else None
-
-    settings = get_settings()
-    with create_engine(
-        URL.create(
-            drivername="postgresql+psycopg",
-            username=settings["username"],
-            password=settings["password"],
-            host=settings["host"].split(":")[0],
-            port=settings.get("port") or settings["host"].split(":")[-1],
-            database=settings["dbname"],
+    wait_list_data = participant_lists.get(event["waitlist"])
+    if wait_list_data:
+        wait_list, category_ids = changed_categories(event["waitlist"], wait_list_data["data"], previous, fingerprints)
+        if category_ids is None or category_ids:
+            scope = event_scope if category_ids is None else {**event_scope, "contest_category_id": category_ids}
+            data_fields = wait_list_data.get("DataFields")
+            tables["athletes_wait_list_df"] = (
+                process("athletes_wait_list_df", scope, process_wait_list_athlete_data, wait_list, data_fields),
+                scope,
+            )
+    return update
+
+
+def refresh_aggregates(connection: Connection, event_id: int) -> None:
+    """Recount the event's athletes into the dashboard summary tables."""
+    for aggregate_name, column in AGGREGATE_TABLES.items():
+        if not sqlalchemy.inspect(connection).has_table(aggregate_name):
+            for statement in (
+                f"""
+                CREATE TABLE "{aggregate_name}" AS
+                SELECT event_id, "{column}", count(*)::integer AS athlete_count
+                FROM "athletes_df" GROUP BY event_id, "{column}" WITH NO DATA
+                """,
+                f'CREATE UNIQUE INDEX ON "{aggregate_name}" (event_id, "{column}") NULLS NOT DISTINCT',
+            ):
+                connection.execute(sqlalchemy.text(statement))
+
+        params = {"event_id": event_id}
+        connection.execute(sqlalchemy.text(f'DELETE FROM "{aggregate_name}" WHERE event_id = :event_id'), params)
+        connection.execute(
+            sqlalchemy.text(
+                f"""
+                INSERT INTO "{aggregate_name}" (event_id, "{column}", athlete_count)
+                SELECT event_id, "{column}", count(*) FROM "athletes_df"
+                WHERE event_id = :event_id GROUP BY event_id, "{column}"
+                """
+            ),
+            params,
         )
-    ).begin() as connection:
-        contest_categories_df.to_sql("contest_categories_df", connection, if_exists="replace", index=False)
-        splits_df.to_sql("splits_df", connection, if_exists="replace", index=False)
-        athlete_df.to_sql("athletes_df", connection, if_exists="replace", index=False)
-        if athletes_wait_list_df is not None:
-            athletes_wait_list_df.to_sql("athletes_wait_list_df", connection, if_exists="replace", index=False)
-
-        # audit dataset updates
-        row = {
-            "created_at": datetime.datetime.now(datetime.UTC),
-            "used_data": json.dumps({"config_data": config_data, "participant_lists": participant_lists}),
-            "athletes_count": len(athlete_df),
-            "athletes_wait_list_count": len(athletes_wait_list_df) if athletes_wait_list_df is not None else 0,
-        }
-        pd.DataFrame([row]).to_sql("dataset_update_events", connection, if_exists="append", index=False)
+
+
+def refresh_rollups(connection: Connection, event_id: int, hour: datetime.datetime) -> None:
+    for table_name in ROLLUP_TABLES:
+        if sqlalchemy.inspect(connection).has_table(table_name):
+            refresh_rollup(connection, table_name, event_id, hour)
+
+
+def completed_tables(update: EventUpdate) -> typing.Iterator[tuple[str, pd.DataFrame, dict[str, list[int]]]]:
+    """
+    Yield the tables of `update` in the order they finish processing, with their delete scope.
+
+    The metrics of their processing move into the current run on the first pass, so a second sink reading the
+    same tables does not record them again. Tables still processing are cancelled when the caller fails.
+    """
+    futures = {future: (table_name, scope) for table_name, (future, scope) in (update["tables"] or {}).items()}
+    try:
+        for future in as_completed(futures):
+            table_name, scope = futures[future]
+            df, metrics = future.result()
+            run = _run_metrics.get()
+            if run is not None:
+                run[1].extend(metrics)
+            metrics.clear()
+            yield table_name, df, scope
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+
+def load_event(connection: Connection, update: EventUpdate, load_mode: str) -> dict[str, dict[str, int]]:
+    """Write an event's changed tables, fingerprints and audit row, or only a heartbeat when nothing changed."""
+    event_id = update["event"]["event_id"]
+    ensure_audit_schema(connection)
+    migrate_schema(connection)
+    used_data_hash = store_raw_payload(
+        connection, update["config_data"], update["participant_lists"], update["fingerprints"]
+    )
+    now = datetime.datetime.now(datetime.UTC)
+    if update["tables"] is None:
+        record_heartbeat(connection, event_id, used_data_hash)
+        refresh_rollups(connection, event_id, now)
+        logger.info("event %s: upstream data unchanged, recorded heartbeat", event_id)
+        return {}
+
+    load_stats = {}
+    for table_name, df, scope in completed_tables(update):
+        load_stats[table_name] = write_table(connection, df, table_name, load_mode, scope)
+        if table_name in HISTORY_TABLES:
+            load_stats[HISTORY_TABLES[table_name]] = update_history(
+                connection, table_name, TABLE_KEYS[table_name], now, scope
+            )
+    refresh_rollups(connection, event_id, now)
+    if "athletes_df" in update["tables"]:
+        refresh_aggregates(connection, event_id)
+
+    fingerprints_df = pd.DataFrame(update["fingerprints"].items(), columns=["name", "content_hash"])
+    fingerprints_df.insert(0, "event_id", event_id)
+    upsert_table(
+        connection,
+        fingerprints_df,
+        "dataset_fingerprints",
+        TABLE_KEYS["dataset_fingerprints"],
+        scope={"event_id": [event_id]},
+    )
+
+    # audit dataset updates
+    has_wait_list = bool(update["participant_lists"].get(update["event"]["waitlist"]))
+    row = {
+        "created_at": now,
+        "used_data": None,
+        "used_data_hash": used_data_hash,
+        "athletes_count": count_rows(connection, "athletes_df", event_id),
+        "athletes_wait_list_count": count_rows(connection, "athletes_wait_list_df", event_id) if has_wait_list else 0,
+        "event_id": event_id,
+    }
+    pd.DataFrame([row]).to_sql("dataset_update_events", connection, if_exists="append", index=False)
+    return load_stats
+
+
+def write_event_postgres(update: EventUpdate, load_mode: str, run_id: str) -> dict[str, dict[str, int]]:
+    """Load an event into the output database in one transaction, see load_event()."""
+    with get_engine().begin() as connection:
+        return load_event(connection, update, load_mode)
+
+
+def write_metrics_postgres(run_id: str, metrics: list[StageMetric]) -> None:
+    with get_engine().begin() as connection:
+        write_run_metrics(connection, metrics)
+
+
+def write_parquet(df: pd.DataFrame, path: Path) -> int:
+    """Write `df` to `path` as compressed Parquet, returning the file size. The file only appears once complete."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(f".{path.name}.partial")
+    # object columns hold text, typed as such so that an all-null column does not become a null column that
+    # conflicts with the same column of other runs
+    text_columns = {column: "string" for column in df.columns if df[column].dtype == object}
+    df.astype(text_columns).to_parquet(partial, compression=PARQUET_COMPRESSION, index=False)
+    partial.replace(path)
+    return path.stat().st_size
+
+
+def write_event_parquet(update: EventUpdate, load_mode: str, run_id: str) -> dict[str, dict[str, int]]:
+    """
+    Write the event's processed tables as Parquet snapshots under PARQUET_PATH.
+
+    Files are hive partitioned as `<table>/run_id=<run>/event_id=<event>/part-0.parquet` (the partition columns are
+    not repeated inside), so DuckDB or pyarrow scans prune by run and event. Only the tables the run processed are
+    written: with the postgres sink that is what changed since the previous run, offline runs process everything.
+    """
+    event_id = update["event"]["event_id"]
+    stats = {}
+    # every table passed validation before the first file is written
+    for table_name, df, _ in list(completed_tables(update)):
+        with timed("write_parquet", table_name) as counts:
+            path = PARQUET_PATH / table_name / f"run_id={run_id}" / f"event_id={event_id}" / "part-0.parquet"
+            counts["bytes"] = write_parquet(df.drop(columns="event_id"), path)
+            counts["rows"] = len(df)
+        stats[table_name] = {"rows": counts["rows"], "bytes": counts["bytes"]}
+    return stats
+
+
+def write_metrics_parquet(run_id: str, metrics: list[StageMetric]) -> None:
+    if metrics:
+        metrics_df = pd.DataFrame(metrics).drop(columns="run_id")
+        write_parquet(metrics_df, PARQUET_PATH / "pipeline_run_metrics" / f"run_id={run_id}" / "part-0.parquet")
+
+
+# outputs a run can write to, selected with SINKS (comma separated); fingerprints are only kept by postgres.
+# parquet is for local and offline runs: the Lambda package has no pyarrow and only /tmp is writable there
+SINKS: dict[str, Sink] = {
+    "postgres": {"write_event": write_event_postgres, "write_metrics": write_metrics_postgres},
+    "parquet": {"write_event": write_event_parquet, "write_metrics": write_metrics_parquet},
+}
+
+
+def run_events(
+    load_mode: str,
+    events: list[EventConfig],
+    sinks: list[str],
+    run_id: str,
+    transport: httpx.AsyncBaseTransport | None = None,
+) -> dict[int, dict[str, typing.Any]]:
+    """Fetch, process and write `events` to `sinks`, see main()."""
+
+    def prepare(event: EventConfig, *args) -> EventUpdate:
+        _metrics_event_id.set(event["event_id"])
+        event_counts = previous_counts.get(event["event_id"], {})
+        return prepare_event(event, *args, executor=process_executor, previous_counts=event_counts)
+
+    fetched = fetch_events(events, transport)
+    load_lazy_modules(np, pd)
+    # created here rather than in the prepare threads, where concurrent first calls would each start a pool
+    process_executor = get_process_executor()
+
+    previous, previous_counts = {}, {}
+    if "postgres" in sinks:
+        with get_engine().connect() as connection:
+            if load_mode != "replace":
+                previous = load_fingerprints(connection)
+            previous_counts = load_row_counts(connection)
+
+    report: dict[int, dict[str, typing.Any]] = {}
+    with ThreadPoolExecutor(max_workers=EVENT_WORKERS) as executor:
+        futures = {}
+        for event, result in zip(events, fetched):
+            if isinstance(result, Exception):
+                logger.error("event %s: fetch failed: %r", event["event_id"], result)
+                report[event["event_id"]] = {"status": "failed", "error": repr(result)}
+                continue
+            config_data, participant_lists, fetch_seconds = result
+            report[event["event_id"]] = {"status": "pending", "fetch_seconds": round(fetch_seconds, 3)}
+            previous_fingerprints = previous.get(event["event_id"], {})
+            future = executor.submit(
+                contextvars.copy_context().run, prepare, event, config_data, participant_lists, previous_fingerprints
+            )
+            futures[future] = event, time.perf_counter()
+
+        for future in as_completed(futures):
+            event, started = futures[future]
+            event_report = report[event["event_id"]]
+            try:
+                update = future.result()
+                event_report["prepare_seconds"] = round(time.perf_counter() - started, 3)
+                started = time.perf_counter()
+                event_token = _metrics_event_id.set(event["event_id"])
+                try:
+                    event_report["tables"] = {}
+                    for sink in sinks:
+                        with timed("load", sink):
+                            for table_name, stats in SINKS[sink]["write_event"](update, load_mode, run_id).items():
+                                event_report["tables"].setdefault(table_name, {}).update(stats)
+                finally:
+                    _metrics_event_id.reset(event_token)
+                event_report["load_seconds"] = round(time.perf_counter() - started, 3)
+                event_report["status"] = "ok"
+            except Exception as exception:
+                logger.exception("event %s: failed", event["event_id"])
+                event_report.update(status="failed", error=repr(exception))
+                if isinstance(exception, BrokenExecutor):
+                    # a worker died (e.g. out of memory), the next run starts a new pool
+                    get_process_executor.cache_clear()
+
+    return report
+
+
+def main(
+    load_mode: str | None = None,
+    events: list[EventConfig] | None = None,
+    sinks: list[str] | None = None,
+    transport: httpx.AsyncBaseTransport | None = None,
+) -> dict[int, dict[str, typing.Any]]:
+    """
+    Ingest every registered event, returning a report per event id.
+
+    Events are fetched concurrently and their tables processed in parallel (see get_process_executor). Each
+    event is written to every sink in turn, to postgres in its own transaction, table by table as they finish
+    processing, so one failing event does not abort the others.
+    The timed() stages of the run are printed as EMF lines and stored by every sink (pipeline_run_metrics).
+    """
+    load_mode = load_mode or os.environ.get("LOAD_MODE", "upsert")
+    events = events or load_events()
+    sinks = sinks or os.environ.get("SINKS", "postgres").split(",")
+    # checked before any sink commits, a later failure would fail the invocation after postgres was written
+    if unknown := [sink for sink in sinks if sink not in SINKS]:
+        raise ValueError(f"unknown sinks {unknown}, expected some of {list(SINKS)}")
+    if "parquet" in sinks and "AWS_LAMBDA_FUNCTION_NAME" in os.environ:
+        raise ValueError("the parquet sink is for local and offline runs, not for Lambda")
+    # sortable by start time, so Parquet partitions list in run order
+    run_id = f"{datetime.datetime.now(datetime.UTC):%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex[:8]}"
+    metrics = []
+    run_token = _run_metrics.set((run_id, metrics))
+    try:
+        report = run_events(load_mode, events, sinks, run_id, transport)
+    finally:
+        _run_metrics.reset(run_token)
+
+    emit_metrics(metrics)
+    for sink in sinks:
+        try:
+            SINKS[sink]["write_metrics"](run_id, metrics)
+        except Exception:
+            logger.exception("run %s: storing metrics in %s failed", run_id, sink)
+
+    logger.info("run %s report: %s", run_id, report)
+    failed = [event_id for event_id, event_report in report.items() if event_report["status"] == "failed"]
+    if failed:
+        raise RuntimeError(f"events failed: {failed}")
+    return report
+
+
+# live mode poll interval bounds, the interval grows by LIVE_BACKOFF per poll without changes
+LIVE_MIN_INTERVAL = float(os.environ.get("LIVE_MIN_INTERVAL", "2"))
+LIVE_MAX_INTERVAL = float(os.environ.get("LIVE_MAX_INTERVAL", "60"))
+LIVE_BACKOFF = 1.5
+
+
+def next_poll_interval(interval: float, changed: bool) -> float:
+    """Poll again quickly after changes and back off while the list stays the same."""
+    if changed:
+        return LIVE_MIN_INTERVAL
+    return min(interval * LIVE_BACKOFF, LIVE_MAX_INTERVAL)
+
+
+def parse_race_time(value: str) -> float | None:
+    """Seconds of a raceresult time like "1:02:03.4", "2:03" or "12.3", None when it is not a time."""
+    try:
+        seconds = 0.0
+        for part in value.strip().split(":"):
+            seconds = seconds * 60 + float(part)
+    except ValueError:
+        return None
+    return seconds
+
+
+def split_positions(config_data: ConfigResponse, data_fields: list[str] | None) -> dict[int, list[tuple[int, int]]]:
+    """
+    (row position, split id) of the split time columns per contest id, 0 holding the splits of every contest.
+
+    With `data_fields` a split's column is the field named like the split's Name or Label, otherwise the
+    results list is assumed to hold the "results" schema columns, then the splits of every contest (contest 0) and
+    then the contest's own splits, each in config order.
+    """
+    positions: dict[int, list[tuple[int, int]]] = {}
+    if data_fields is not None:
+        field_positions = {field.casefold(): i for i, field in reversed(list(enumerate(data_fields)))}
+        for split in config_data["splits"]:
+            names = [split["Name"].casefold(), split["Label"].casefold()]
+            position = next((field_positions[name] for name in names if name in field_positions), None)
+            if position is not None:
+                positions.setdefault(split["Contest"], []).append((position, split["ID"]))
+        return positions
+
+    offset = len(LIST_SCHEMAS["results"]["columns"])
+    shared = [split["ID"] for split in config_data["splits"] if split["Contest"] == 0]
+    if shared:
+        positions[0] = [(offset + i, split_id) for i, split_id in enumerate(shared)]
+    for split in config_data["splits"]:
+        if split["Contest"] != 0:
+            contest_splits = positions.setdefault(split["Contest"], [])
+            contest_splits.append((offset + len(shared) + len(contest_splits), split["ID"]))
+    return positions
+
+
+def diff_split_times(
+    event_id: int, config_data: ConfigResponse, response: ParticipantListResponse, seen: dict[str, typing.Any]
+) -> tuple[list[SplitTime], dict[str, dict]]:
+    """
+    Split times of a results list response that are new or changed since the responses already in `seen`.
+
+    `seen` holds the fingerprint of every category and the last time of every split, so unchanged categories
+    are skipped without looking at their rows. It is not modified, the entries to merge into it once the split
+    times are written are returned next to them.
+    """
+    data_fields = response.get("DataFields")
+    bib_position = compile_list_schema("results", None if data_fields is None else tuple(data_fields))["bib"]
+    positions = split_positions(config_data, data_fields)
+    category_hashes = seen.get("categories", {})
+    times = seen.get("times", {})
+    changes: dict[str, dict] = {"categories": {}, "times": {}}
+    now = datetime.datetime.now(datetime.UTC)
+
+    records: list[SplitTime] = []
+    for category, rows in response["data"].items():
+        content_hash = canonical_hash(rows)
+        match = re.search(r"#(\d+)_", category)
+        if category_hashes.get(category) == content_hash or match is None or bib_position is None:
+            continue
+        changes["categories"][category] = content_hash
+        rows = decode_rows(rows)
+        contest_id = int(match.group(1))
+        contest_splits = positions.get(0, []) + positions.get(contest_id, [])
+        for row in rows:
+            bib = row[bib_position].strip() if bib_position < len(row) else ""
+            if not bib.isdigit():
+                continue
+            for position, split_id in contest_splits:
+                value = row[position].strip() if position < len(row) else ""
+                if not value or times.get((int(bib), split_id)) == value:
+                    continue
+                changes["times"][int(bib), split_id] = value
+                records.append(
+                    {
+                        "event_id": event_id,
+                        "bib": int(bib),
+                        "split_id": split_id,
+                        "contest_category_id": contest_id,
+                        "time": value,
+                        "seconds": parse_race_time(value),
+                        "recorded_at": now,
+                    }
+                )
+    return records, changes
+
+
+def ensure_split_times_table(connection: Connection) -> None:
+    connection.execute(
+        sqlalchemy.text(
+            """
+            CREATE TABLE IF NOT EXISTS "split_times" (
+                event_id bigint NOT NULL,
+                bib integer NOT NULL,
+                split_id integer NOT NULL,
+                contest_category_id integer NOT NULL,
+                time text NOT NULL,
+                seconds double precision,
+                recorded_at timestamptz NOT NULL,
+                PRIMARY KEY (event_id, bib, split_id)
+            )
+            """
+        )
+    )
+    connection.execute(
+        sqlalchemy.text(
+            'CREATE INDEX IF NOT EXISTS "split_times_event_split_idx" ON "split_times" (event_id, split_id, seconds)'
+        )
+    )
+
+
+def write_split_times(connection: Connection, records: list[SplitTime]) -> int:
+    """Upsert `records` into split_times, corrected times replace the earlier ones."""
+    result = connection.execute(
+        sqlalchemy.text(
+            """
+            INSERT INTO "split_times" (event_id, bib, split_id, contest_category_id, time, seconds, recorded_at)
+            VALUES (:event_id, :bib, :split_id, :contest_category_id, :time, :seconds, :recorded_at)
+            ON CONFLICT (event_id, bib, split_id) DO UPDATE
+                SET contest_category_id = EXCLUDED.contest_category_id, time = EXCLUDED.time,
+                    seconds = EXCLUDED.seconds, recorded_at = EXCLUDED.recorded_at
+                WHERE "split_times".time IS DISTINCT FROM EXCLUDED.time
+            """
+        ),
+        records,
+    )
+    return result.rowcount
+
+
+async def poll_results(
+    event: EventConfig,
+    engine: Engine,
+    transport: httpx.AsyncBaseTransport | None = None,
+    max_polls: int | None = None,
+    sleep: typing.Callable[[float], typing.Awaitable[None]] | None = None,
+) -> int:
+    """
+    Poll `event`'s results list until `max_polls` (forever when None), returning the split times written.
+
+    A failing poll (fetch, response or write) is logged and retried after backing off, its split times are only
+    marked as seen once they are written.
+    """
+    list_params = {"page": "results", "contest": "0", "r": "all", "l": "0", "listname": event["results"]}
+    written, polls, interval = 0, 0, LIVE_MIN_INTERVAL
+    sleep = sleep or asyncio.sleep
+
+    def write(records: list[SplitTime]) -> None:
+        with engine.begin() as connection:
+            write_split_times(connection, records)
+
+    async with raceresult_client(event, transport) as client:
+        config_url = RACERESULT_URL.format(event_id=event["event_id"], endpoint="config")
+        config_data: ConfigResponse | None = None
+        list_url = RACERESULT_URL.format(event_id=event["event_id"], endpoint="list")
+        seen: dict[str, dict] = {"categories": {}, "times": {}}
+
+        while max_polls is None or polls < max_polls:
+            started = time.perf_counter()
+            try:
+                if config_data is None:
+                    config_data = await get_json(client, config_url, {"page": "results", "noVisitor": "1"})
+                response = await get_json(
+                    client, list_url, {**list_params, "key": config_data["key"]}, decode_list_response
+                )
+                records, changes = diff_split_times(event["event_id"], config_data, response, seen)
+                if records:
+                    await asyncio.to_thread(write, records)
+                    written += len(records)
+                    logger.info(
+                        "event %s: %d split times in %.3fs",
+                        event["event_id"],
+                        len(records),
+                        time.perf_counter() - started,
+                    )
+                for name, entries in changes.items():
+                    seen[name].update(entries)
+                changed = bool(records)
+            except Exception as exception:
+                logger.exception("event %s: poll failed", event["event_id"])
+                if is_client_error(exception):
+                    # the request key expired, the next poll fetches the config and a new one
+                    config_data = None
+                changed = False
+            polls += 1
+            interval = next_poll_interval(interval, changed)
+            if max_polls is None or polls < max_polls:
+                await sleep(interval)
+    return written
+
+
+def live(
+    events: list[EventConfig] | None = None,
+    transport: httpx.AsyncBaseTransport | None = None,
+    max_polls: int | None = None,
+    sleep: typing.Callable[[float], typing.Awaitable[None]] | None = None,
+) -> dict[int, int]:
+    """Poll the results list of every event that has one, returning the split times written per event id."""
+    events = [event for event in events or load_events() if event.get("results")]
+    engine = get_engine()
+    with engine.begin() as connection:
+        ensure_split_times_table(connection)
+
+    async def poll_all():
+        return await asyncio.gather(*(poll_results(event, engine, transport, max_polls, sleep) for event in events))
+
+    return dict(zip([event["event_id"] for event in events], asyncio.run(poll_all())))
+
+
+def record_events(
+    path: Path, events: list[EventConfig] | None = None, transport: httpx.AsyncBaseTransport | None = None
+) -> list[Path]:
+    """Fetch every registered event and save its responses as `<path>/<event id>.json` recordings for offline()."""
+    events = events or load_events()
+    path.mkdir(parents=True, exist_ok=True)
+    recording_paths = []
+    for event, result in zip(events, fetch_events(events, transport)):
+        if isinstance(result, Exception):
+            logger.error("event %s: fetch failed: %r", event["event_id"], result)
+            continue
+        config_data, participant_lists, _ = result
+        recording: Recording = {"event": event, "config": config_data, "lists": participant_lists}
+        recording_path = path / f"{event['event_id']}.json"
+        recording_path.write_bytes(canonical_json(recording))
+        recording_paths.append(recording_path)
+    return recording_paths
+
+
+def offline(recording_paths: list[Path], sinks: list[str] | None = None) -> dict[int, dict[str, typing.Any]]:
+    """
+    Run the pipeline on recordings (see record_events) instead of raceresult, into the parquet sink by default.
+
+    The recordings are served through replay_transport, so fetching, processing and writing run as in main().
+    """
+    recordings: dict[int, list[Recording]] = {}
+    events = []
+    for recording_path in recording_paths:
+        recording: Recording = json.loads(recording_path.read_text(encoding="utf-8"))
+        if "event" not in recording:
+            raise ValueError(f"{recording_path}: recording has no event entry")
+        if recording["event"]["event_id"] not in recordings:
+            events.append(recording["event"])
+        recordings.setdefault(recording["event"]["event_id"], []).append(recording)
+    return main(events=events, sinks=sinks or ["parquet"], transport=replay_transport(recordings))
 
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ["migrate-used-data"]:
+        with get_engine().begin() as connection:
+            print(migrate_used_data(connection))
+    elif sys.argv[1:] == ["live"]:
+        live()
+    elif sys.argv[1:2] in (["record"], ["offline"]):
+        import argparse
+
+        parser = argparse.ArgumentParser(prog=f"lambda_function.py {sys.argv[1]}")
+        if sys.argv[1] == "record":
+            parser.add_argument("path", type=Path, help="directory for the recordings")
+            args = parser.parse_args(sys.argv[2:])
+            print("\n".join(map(str, record_events(args.path))))
+        else:
+            parser.add_argument("recordings", type=Path, nargs="+", help="recording files written by record")
+            parser.add_argument("--sink", dest="sinks", action="append", choices=SINKS, help="default: parquet")
+            parser.add_argument("--output", type=Path, default=PARQUET_PATH, help="root of the parquet snapshots")
+            args = parser.parse_args(sys.argv[2:])
+            PARQUET_PATH = args.output
+            print(json.dumps(offline(args.recordings, args.sinks), indent=2))
+    else:
+        main()
 
 
 def lambda_handler(event, context):
@@ -19,6 +19,12 @@ variable "aws_region" {
   default     = "eu-central-1"
 }
 
+variable "db_pooler_host" {
+  description = "Optional host[:port] of an RDS Proxy or PgBouncer the Lambda connects through"
+  type        = string
+  default     = ""
+}
+
 provider "aws" {
   region = var.aws_region
 }
@@ -162,7 +168,8 @@ resource "aws_lambda_function" "periodic_lambda" {
 
   environment {
     variables = {
-      SECRET_NAME = aws_secretsmanager_secret.db_credentials.name
+      SECRET_NAME    = aws_secretsmanager_secret.db_credentials.name
+      DB_POOLER_HOST = var.db_pooler_host
     }
   }
   depends_on = [
@@ -1,8 +1,24 @@
+import asyncio
 import datetime
+import importlib.util
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
 import unittest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from unittest import mock
 import pandas as pd
+import httpx
+import sqlalchemy
+from pathlib import Path
+from sqlalchemy import create_engine, text
 import lambda_function
 
+DASHBOARD_PATH = Path(__file__).parent / "dashboard" / "dashboards" / "dashboard.json"
+
 
 class TestProcessSplitsData(unittest.TestCase):
     def test_process_splits_data(self):
@@ -92,6 +108,22 @@ class TestProcessSplitsData(unittest.TestCase):
             with self.subTest(label=label, expected=expected):
                 self.assertEqual(lambda_function.get_english_translation(label), expected)
 
+    def test_convert_countries_in_parallel_threads(self):
+        def resolve_country_codes(codes):
+            return {code: code and f"Country {code}" for code in codes}
+
+        series = [pd.Series([f"C{i}", f"C{i + 1}", "", f"C{i}"] * 1000, name="country") for i in range(64)]
+        with (
+            mock.patch.object(lambda_function, "get_country_names", return_value={}),
+            mock.patch.object(lambda_function, "resolve_country_codes", side_effect=resolve_country_codes),
+            ThreadPoolExecutor(8) as executor,
+        ):
+            results = list(executor.map(lambda_function.convert_countries, series))
+        for i, result in enumerate(results):
+            self.assertEqual(
+                result.iloc[:4].fillna("").tolist(), [f"Country C{i}", f"Country C{i + 1}", "", f"Country C{i}"]
+            )
+
     def test_process_athlete_data(self):
         # Mock athlete data structured as in the example
         mock_athlete_data = {
@@ -201,6 +233,9 @@ class TestProcessSplitsData(unittest.TestCase):
             }
         )
 
+        categorical = ["contest", "gender", "age_group", "club", "country", "contest_category"]
+        expected_output[categorical] = expected_output[categorical].astype("category")
+
         output_df = lambda_function.process_athlete_data(mock_athlete_data)
         pd.testing.assert_frame_equal(output_df.reset_index(drop=True), expected_output.reset_index(drop=True))
 
@@ -254,10 +289,943 @@ class TestProcessSplitsData(unittest.TestCase):
             }
         )
 
+        categorical = ["gender", "age_group", "country", "contest_category"]
+        expected_output[categorical] = expected_output[categorical].astype("category")
+
         output_df = lambda_function.process_wait_list_athlete_data(mock_waitlist_data)
 
         pd.testing.assert_frame_equal(output_df.reset_index(drop=True), expected_output.reset_index(drop=True))
 
+    def test_build_frame(self):
+        data = {"#1_A": [["1", "Anna", "flag"], ["2"]], "#2_B": [], "#3_C": [["3", "Ben", "flag"]]}
+
+        output_df = lambda_function.build_frame(data, {"bib": 0, "name": 1, "club": None}, "category", ["name"])
+
+        expected_output = pd.DataFrame(
+            {
+                "bib": ["1", "2", "3"],
+                "name": ["Anna", None, "Ben"],
+                "club": [None, None, None],
+                "category": ["#1_A", "#1_A", "#3_C"],
+            },
+            dtype=object,
+        ).astype({"name": "category", "category": "category"})
+        pd.testing.assert_frame_equal(output_df, expected_output)
+
+    def test_process_athlete_data_with_number_cells(self):
+        athlete = ["", " Felipe ABELLA ", "M", "", "M20-34", " TV Zürich ", "", "", "SUI"]
+        data = {"#1_Olympisch": [[1660, *athlete, 1993], [278, *athlete, ""]]}
+
+        output_df = lambda_function.process_athlete_data(data)
+
+        self.assertEqual(output_df["bib"].tolist(), [1660, 278])
+        self.assertEqual(output_df["year_born"].tolist(), [1993, pd.NA])
+        self.assertEqual(output_df["name"].tolist(), ["Felipe Abella"] * 2)
+        self.assertEqual(output_df["club"].tolist(), ["TV Zürich"] * 2)
+        self.assertTrue(output_df["company"].isna().all())
+
+    def test_extract_list_maps_data_fields_by_name(self):
+        data = {
+            "#1_Olympisch": [["Anna Muster", "", "SUI", "W", "101", "X"], ["Ben Beispiel", "", "GER", "M", "102", "Y"]]
+        }
+        data_fields = ["DisplayName", "NATION.FLAG", "Nation", "GenderMF", "BIB", "NewField"]
+
+        output_df = lambda_function.extract_list(data, "athletes", data_fields)
+
+        self.assertEqual(
+            list(output_df.columns),
+            [
+                "bib",
+                "contest",
+                "name",
+                "gender",
+                "start",
+                "age_group",
+                "club",
+                "company",
+                "country",
+                "year_born",
+                "contest_category",
+            ],
+        )
+        self.assertEqual(output_df["bib"].tolist(), ["101", "102"])
+        self.assertEqual(output_df["name"].tolist(), ["Anna Muster", "Ben Beispiel"])
+        self.assertEqual(output_df["country"].tolist(), ["SUI", "GER"])
+        self.assertTrue(output_df["club"].isna().all())
+        # compiled once per layout
+        self.assertIs(
+            lambda_function.compile_list_schema("athletes", tuple(data_fields)),
+            lambda_function.compile_list_schema("athletes", tuple(data_fields)),
+        )
+
+
+EVENT = {
+    "event_id": 307885,
+    "name": "Zurich City Triathlon 2025",
+    "origin": "https://zurichcitytriathlon.ch",
+    "startlist": "000-Startlists|Startlist",
+    "waitlist": "000-Startlists|Waitlist",
+}
+
+
+class TestPrepareEvent(unittest.TestCase):
+    def test_process_pool_matches_inline(self):
+        athlete = ["", "", "Felipe ABELLA", "M", "", "M20-34", "", "", "", "SUI", "1993"]
+        config_data = {"key": "k1", "contests": {"1": "Olympisch"}, "splits": [{"ID": 1, "Name": "Swim"}]}
+        participant_lists = {
+            EVENT["startlist"]: {"data": {"#1_Olympisch": [["1660", *athlete[1:]]]}},
+            EVENT["waitlist"]: {
+                "data": {"#1_Olympisch": [["1", "7", "1", "Markus ACKERMANN", "M", "M55-64", "", "GER"]]}
+            },
+        }
+
+        def prepare(executor=None):
+            metrics = []
+            token = lambda_function._run_metrics.set(("run", metrics))
+            try:
+                update = lambda_function.prepare_event(EVENT, config_data, participant_lists, {}, executor)
+            finally:
+                lambda_function._run_metrics.reset(token)
+            return {name: future.result() for name, (future, _) in update["tables"].items()}, metrics
+
+        inline, inline_metrics = prepare()
+        with ProcessPoolExecutor(2) as executor:
+            pooled, pool_metrics = prepare(executor)
+
+        # metrics of the workers come back with the frames, the run only gets the prepare_event stages directly
+        self.assertEqual([metric["stage"] for metric in pool_metrics], ["fingerprint"])
+        self.assertEqual(inline.keys(), pooled.keys())
+        for table_name, (df, metrics) in pooled.items():
+            pd.testing.assert_frame_equal(df, inline[table_name][0])
+            self.assertIn(
+                ("run", 307885, "process", table_name),
+                [(metric["run_id"], metric["event_id"], metric["stage"], metric["target"]) for metric in metrics],
+            )
+        self.assertIn("convert_countries", [metric["stage"] for metric in pooled["athletes_df"][1]])
+
+    def test_events_share_one_process_executor(self):
+        events = [{**EVENT, "event_id": event_id} for event_id in (1, 2, 3)]
+        with (
+            ThreadPoolExecutor(2) as executor,
+            mock.patch.object(lambda_function, "fetch_events", return_value=[({}, {}, 0.1)] * 3),
+            mock.patch.object(lambda_function, "get_process_executor", return_value=executor) as get_process_executor,
+            mock.patch.object(lambda_function, "prepare_event") as prepare_event,
+        ):
+            report = lambda_function.run_events("upsert", events, [], "run")
+
+        get_process_executor.assert_called_once_with()
+        self.assertEqual([call.kwargs["executor"] for call in prepare_event.call_args_list], [executor] * 3)
+        self.assertEqual([event_report["status"] for event_report in report.values()], ["ok"] * 3)
+
+
+class TestValidation(unittest.TestCase):
+    def athletes(self, n, contest_category_id=1):
+        return pd.DataFrame(
+            {
+                "bib": pd.Series(range(1, n + 1), dtype="Int64"),
+                "contest_category_id": pd.Series([contest_category_id] * n, dtype="Int64"),
+                "gender": pd.Series(["Male", "Female"] * (n // 2), dtype="category"),
+                "country": pd.Series(["Switzerland"] * n, dtype="category"),
+                "year_born": pd.Series([1990] * n, dtype="Int64"),
+                "age": pd.Series([35] * n, dtype="Int64"),
+            }
+        )
+
+    def test_valid_table_passes(self):
+        df = self.athletes(200)
+        df.loc[0, ["bib", "year_born", "age"]] = pd.NA
+        df.loc[1, "gender"] = pd.NA
+        with mock.patch.object(lambda_function, "get_country_names", return_value={"SUI": "Switzerland"}):
+            lambda_function.validate_table("athletes_df", df, previous_rows={1: 200})
+
+    def test_failing_checks_raise(self):
+        df = self.athletes(200)
+        df.loc[1, "bib"] = 1
+        df.loc[:9, "year_born"] = 20
+        df["gender"] = df["gender"].cat.add_categories(["X"])
+        df.loc[:1, "gender"] = "X"  # within the tolerance of 1%, only logged
+        df["country"] = df["country"].cat.add_categories(["XYZ"])
+        df.loc[:19, "country"] = "XYZ"
+        with (
+            mock.patch.object(lambda_function, "get_country_names", return_value={"SUI": "Switzerland", "XYZ": "XYZ"}),
+            self.assertLogs(lambda_function.logger, "WARNING") as logs,
+            self.assertRaises(lambda_function.ValidationError) as raised,
+        ):
+            lambda_function.validate_table("athletes_df", df, previous_rows={1: 1000})
+        self.assertEqual(
+            str(raised.exception).split("; "),
+            [
+                "athletes_df: unique bib: 1 of 200 rows",
+                "athletes_df: range year_born: 10 of 200 rows",
+                "athletes_df: country country: 20 of 200 rows",
+                "athletes_df: 800 of the previous run's 1000 rows in contest category 1 are gone",
+            ],
+        )
+        self.assertEqual(
+            logs.output, ["WARNING:lambda_function:athletes_df: values gender: 2 of 200 rows (within tolerance)"]
+        )
+
+    def test_row_count_needs_a_previous_run(self):
+        with mock.patch.object(lambda_function, "get_country_names", return_value={"SUI": "Switzerland"}):
+            lambda_function.validate_table("athletes_df", self.athletes(2), previous_rows=None)
+            lambda_function.validate_table("athletes_df", self.athletes(2), previous_rows={1: 40})
+
+    def test_row_count_is_checked_per_category(self):
+        # the total grows, but every athlete of contest category 1 is gone
+        df = pd.concat([self.athletes(100, contest_category_id=2), self.athletes(100, contest_category_id=3)])
+        df["bib"] = pd.Series(range(1, 201), dtype="Int64").to_numpy()
+        with (
+            mock.patch.object(lambda_function, "get_country_names", return_value={"SUI": "Switzerland"}),
+            self.assertRaisesRegex(
+                lambda_function.ValidationError,
+                r"^athletes_df: 100 of the previous run's 100 rows in contest category 1",
+            ),
+        ):
+            lambda_function.validate_table("athletes_df", df, previous_rows={1: 100, 2: 100})
+
+
+class TestFetchAthleteData(unittest.TestCase):
+    def setUp(self):
+        lambda_function._conditional_cache.clear()
+        self.requests = []
+        self.failures = {"000-Startlists|Waitlist": 1}
+        self.keys = 0
+
+    def handler(self, request):
+        self.requests.append(request)
+        if request.url.path.endswith("/config"):
+            # the request key rotates with every config request
+            self.keys += 1
+            lists = [{"Name": "000-Startlists|Startlist"}, {"Name": "000-Startlists|Waitlist"}]
+            return httpx.Response(200, json={"key": f"k{self.keys}", "lists": lists})
+
+        listname = request.url.params["listname"]
+        if self.failures.get(listname):
+            self.failures[listname] -= 1
+            return httpx.Response(503)
+        if request.headers.get("if-none-match") == f'"{listname}"':
+            return httpx.Response(304)
+        return httpx.Response(200, json={"data": {"#1_Olympisch": [[listname]]}}, headers={"etag": f'"{listname}"'})
+
+    def test_fetch_retries_single_list(self):
+        transport = httpx.MockTransport(self.handler)
+        with mock.patch("asyncio.sleep", new=mock.AsyncMock()):
+            config_data, participant_lists = lambda_function.fetch_athlete_data(EVENT, transport)
+
+        self.assertEqual(config_data["key"], "k1")
+        # categories are kept as their canonical JSON
+        self.assertEqual(
+            participant_lists["000-Startlists|Waitlist"], {"data": {"#1_Olympisch": b'[["000-Startlists|Waitlist"]]'}}
+        )
+        paths = [request.url.path.rsplit("/", 1)[-1] for request in self.requests]
+        self.assertEqual(paths.count("config"), 1)
+        self.assertEqual(paths.count("list"), 3)
+        self.assertEqual(self.requests[-1].url.params["key"], "k1")
+
+    def test_decode_list_response(self):
+        response = {
+            "list": {"ListName": "Startlist", "Fields": [{"Expression": "BIB"}]},
+            "data": {"#1_Olympisch": [["1660", ' Zoë "Z" MÜLLER'], ["1697", "A/B"]], "#5_U14": [], "#6_G": {"x": [1]}},
+            "DataFields": ["BIB", "DisplayName"],
+        }
+        for body in (json.dumps(response).encode(), json.dumps(response, indent=2, ensure_ascii=False).encode()):
+            with self.subTest(body=body[:20]):
+                decoded = lambda_function.decode_list_response(body)
+                self.assertIsInstance(decoded["data"]["#1_Olympisch"], bytes)
+                self.assertEqual(
+                    {category: lambda_function.decode_rows(rows) for category, rows in decoded["data"].items()},
+                    response["data"],
+                )
+                self.assertEqual(decoded["DataFields"], response["DataFields"])
+                self.assertEqual(
+                    lambda_function.fingerprint_payload({}, {"list": decoded}),
+                    lambda_function.fingerprint_payload({}, {"list": response}),
+                )
+        self.assertEqual(lambda_function.decode_list_response(b'{"data": {}}'), {"data": {}})
+        for body in (b'{"data": {"#1": []} "x": 1}', b'{"data": {"#1": []}} x', b'{"data": {"#1" []}}'):
+            with self.subTest(body=body), self.assertRaises(json.JSONDecodeError):
+                lambda_function.decode_list_response(body)
+
+    def test_fetch_reuses_unmodified_lists(self):
+        transport = httpx.MockTransport(self.handler)
+        self.failures = {}
+        _, first = lambda_function.fetch_athlete_data(EVENT, transport)
+        self.requests.clear()
+        _, second = lambda_function.fetch_athlete_data(EVENT, transport)
+
+        self.assertEqual(first, second)
+        self.assertEqual(
+            [request.headers.get("if-none-match") for request in self.requests[1:]],
+            ['"000-Startlists|Startlist"', '"000-Startlists|Waitlist"'],
+        )
+        self.assertEqual([request.url.params["key"] for request in self.requests[1:]], ["k2", "k2"])
+        # one compressed body per list, not per key
+        self.assertEqual(len(lambda_function._conditional_cache), 2)
+        self.assertTrue(all(isinstance(body, bytes) for _, _, body in lambda_function._conditional_cache.values()))
+
+
+class TestSinks(unittest.TestCase):
+    def test_sinks_are_checked_before_the_run(self):
+        with mock.patch.object(lambda_function, "run_events") as run_events:
+            with self.assertRaisesRegex(ValueError, "unknown sinks"):
+                lambda_function.main(events=[EVENT], sinks=["postgres", "s3"])
+            with (
+                mock.patch.dict(os.environ, {"AWS_LAMBDA_FUNCTION_NAME": "pipeline"}),
+                self.assertRaisesRegex(ValueError, "parquet sink"),
+            ):
+                lambda_function.main(events=[EVENT], sinks=["postgres", "parquet"])
+        run_events.assert_not_called()
+
+
+class TestLiveResults(unittest.TestCase):
+    config_data = {
+        "key": "k1",
+        "contests": {"1": "Olympisch"},
+        "splits": [
+            {"ID": 1, "Name": "Swim", "Label": "Swim", "SplitType": 0, "Contest": 0, "TypeOfSport": 1},
+            {"ID": 4, "Name": "Finish", "Label": "Finish", "SplitType": 0, "Contest": 1, "TypeOfSport": 0},
+        ],
+    }
+
+    def test_split_positions_without_data_fields(self):
+        response = {"data": {"#1_Olympisch": [["1660", "Felipe Abella", "24:03", "2:01:10"]]}}
+        records, _ = lambda_function.diff_split_times(307885, self.config_data, response, {})
+        self.assertEqual([(record["split_id"], record["time"]) for record in records], [(1, "24:03"), (4, "2:01:10")])
+
+    def test_poll_fetches_a_new_key_after_a_client_error(self):
+        keys = []
+
+        def handler(request):
+            if request.url.path.endswith("/config"):
+                return httpx.Response(200, json={**self.config_data, "key": f"k{len(keys) + 1}"})
+            keys.append(request.url.params["key"])
+            if request.url.params["key"] == "k1" and len(keys) > 1:
+                return httpx.Response(403)
+            return httpx.Response(200, json={"data": {}})
+
+        with self.assertLogs(lambda_function.logger, "ERROR"):
+            asyncio.run(
+                lambda_function.poll_results(
+                    {**EVENT, "results": "02-Results|Live"},
+                    None,
+                    httpx.MockTransport(handler),
+                    max_polls=4,
+                    sleep=mock.AsyncMock(),
+                )
+            )
+        self.assertEqual(keys, ["k1", "k1", "k3", "k3"])
+
+
+@unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow not installed")
+class TestOfflineMode(unittest.TestCase):
+    def test_record_and_run_offline_into_parquet(self):
+        import pyarrow.dataset
+
+        athlete = ["", "", "Felipe ABELLA", "M", "", "M20-34", "", "", "", "SUI", "1993"]
+        recording = {
+            "config": {
+                "key": "k1",
+                "contests": {"1": "Olympisch"},
+                "splits": [],
+                "lists": [{"Name": EVENT["startlist"]}],
+            },
+            "lists": {EVENT["startlist"]: {"data": {"#1_Olympisch": [["1660", *athlete[1:]], ["1697", *athlete[1:]]]}}},
+        }
+        transport = lambda_function.replay_transport({EVENT["event_id"]: [recording]})
+        lambda_function._conditional_cache.clear()
+        with tempfile.TemporaryDirectory() as directory:
+            root = Path(directory)
+            recording_paths = lambda_function.record_events(root / "recordings", [EVENT], transport)
+            with (
+                mock.patch.object(lambda_function, "PARQUET_PATH", root / "snapshots"),
+                mock.patch.object(lambda_function, "get_engine", side_effect=AssertionError("no database offline")),
+                mock.patch("builtins.print"),
+            ):
+                report = lambda_function.offline(recording_paths)
+
+            self.assertEqual(recording_paths, [root / "recordings" / "307885.json"])
+            self.assertEqual(report[307885]["tables"]["athletes_df"]["rows"], 2)
+            athletes = pyarrow.dataset.dataset(root / "snapshots" / "athletes_df", partitioning="hive")
+            table = athletes.to_table(
+                columns=["bib", "country", "run_id"], filter=pyarrow.dataset.field("event_id") == 307885
+            )
+            self.assertEqual(sorted(table["bib"].to_pylist()), [1660, 1697])
+            self.assertEqual(table["country"].to_pylist(), ["Switzerland", "Switzerland"])
+            (run_id,) = set(table["run_id"].to_pylist())
+            metrics = pyarrow.dataset.dataset(
+                root / "snapshots" / "pipeline_run_metrics", partitioning="hive"
+            ).to_table()
+            self.assertEqual(set(metrics["run_id"].to_pylist()), {run_id})
+            self.assertLessEqual({"fetch", "process", "write_parquet", "load"}, set(metrics["stage"].to_pylist()))
+
+
+class TestColdStart(unittest.TestCase):
+    def test_import_does_not_load_heavy_modules(self):
+        heavy_modules = ["pandas", "httpx", "sqlalchemy", "country_converter", "backoff", "boto3", "asyncio"]
+        code = (
+            "import sys, lambda_function;"
+            f"print([m for m in {heavy_modules!r} if type(sys.modules.get(m)).__name__ == 'module'])"
+        )
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), "[]")
+
+
+class TestDatabaseSettings(unittest.TestCase):
+    secret = {"username": "user", "password": "old", "host": "db.example.com:5432", "dbname": "triathlon"}
+
+    def setUp(self):
+        patches = [
+            mock.patch.object(lambda_function, "_settings", None),
+            mock.patch.object(lambda_function, "_engine", None),
+            mock.patch.dict(os.environ, {"SECRET_NAME": "secret"}),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.boto3 = mock.MagicMock()
+        self.secret_string = json.dumps(self.secret)
+        self.boto3.client.return_value.get_secret_value.side_effect = lambda **_: {"SecretString": self.secret_string}
+
+    def test_get_settings_refetches_after_ttl(self):
+        with (
+            mock.patch.dict(sys.modules, {"boto3": self.boto3}),
+            mock.patch.object(lambda_function.time, "monotonic") as monotonic,
+        ):
+            monotonic.return_value = 1000.0
+            self.assertEqual(lambda_function.get_settings()["password"], "old")
+            self.secret_string = json.dumps({**self.secret, "password": "new"})
+            monotonic.return_value = 1000.0 + lambda_function.SETTINGS_TTL - 1
+            self.assertEqual(lambda_function.get_settings()["password"], "old")
+            monotonic.return_value = 1000.0 + lambda_function.SETTINGS_TTL
+            self.assertEqual(lambda_function.get_settings()["password"], "new")
+        self.assertEqual(self.boto3.client.return_value.get_secret_value.call_count, 2)
+
+    def test_get_engine_is_reused_until_credentials_rotate(self):
+        settings = dict(self.secret)
+        with mock.patch.object(lambda_function, "get_settings", side_effect=lambda: settings):
+            engine = lambda_function.get_engine()
+            self.assertIs(lambda_function.get_engine(), engine)
+            self.assertEqual((engine.url.host, engine.url.port), ("db.example.com", 5432))
+            self.assertTrue(engine.pool._pre_ping)
+            self.assertEqual(engine.pool.size(), lambda_function.DB_POOL_SIZE)
+
+            settings["password"] = "new"
+            with mock.patch.object(engine, "dispose") as dispose:
+                rotated = lambda_function.get_engine()
+            dispose.assert_called_once()
+            self.assertIsNot(rotated, engine)
+            self.assertEqual(rotated.url.password, "new")
+
+    def test_get_engine_connects_through_pooler(self):
+        with (
+            mock.patch.object(lambda_function, "get_settings", return_value=self.secret),
+            mock.patch.object(lambda_function, "DB_POOLER_HOST", "proxy.example.com:6432"),
+            mock.patch.object(lambda_function.sqlalchemy, "create_engine") as create_engine_mock,
+        ):
+            lambda_function.get_engine()
+        url = create_engine_mock.call_args.args[0]
+        self.assertEqual((url.host, url.port, url.database), ("proxy.example.com", 6432, "triathlon"))
+        self.assertEqual(create_engine_mock.call_args.kwargs["connect_args"], {"prepare_threshold": None})
+
+
+@unittest.skipUnless(os.environ.get("TEST_DATABASE_URL"), "TEST_DATABASE_URL not set")
+class TestIncrementalLoad(unittest.TestCase):
+    tables = [
+        "athletes_df",
+        "athletes_wait_list_df",
+        "splits_df",
+        "contest_categories_df",
+        "dataset_fingerprints",
+        "dataset_update_events",
+        "raw_snapshots",
+        "athletes_history",
+        "athletes_hourly_rollup",
+        "split_times",
+        "pipeline_run_metrics",
+        *lambda_function.AGGREGATE_TABLES,
+        *lambda_function.LOOKUP_TABLES,
+    ]
+
+    def setUp(self):
+        self.engine = create_engine(os.environ["TEST_DATABASE_URL"])
+        with self.engine.begin() as connection:
+            for table in self.tables:
+                connection.execute(text(f'DROP TABLE IF EXISTS "{table}"'))
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_upsert_table(self):
+        for writer in ("to_sql", "copy"):
+            with self.subTest(writer=writer):
+                self.setUp()
+                self._test_upsert_table(writer)
+
+    def _test_upsert_table(self, writer):
+        df = pd.DataFrame(
+            {
+                "bib": pd.Series([1, 2, 3], dtype="Int64"),
+                "name": ["Felipe Abella", "Markus Ackermann", "Seline Ackermann"],
+                "club": pd.Series([pd.NA, "Blaue Funken Köln", pd.NA]),
+            }
+        )
+        with self.engine.begin() as connection:
+            stats = lambda_function.upsert_table(connection, df, "athletes_df", ["bib"], writer)
+        self.assertEqual(stats, {"inserted": 3, "updated": 0, "deleted": 0, "dropped": 0})
+
+        df = pd.DataFrame(
+            {
+                "bib": pd.Series([2, 3, 4], dtype="Int64"),
+                "name": ["Markus Ackermann", "Seline Ackermann", "Eleonora Beck"],
+                "club": pd.Series(["Blaue Funken Köln", "Schweiz", pd.NA]),
+            }
+        )
+        with self.engine.begin() as connection:
+            stats = lambda_function.upsert_table(connection, df, "athletes_df", ["bib"], writer)
+            rows = connection.execute(text('SELECT bib, club FROM "athletes_df" ORDER BY bib')).all()
+        self.assertEqual(stats, {"inserted": 1, "updated": 1, "deleted": 1, "dropped": 0})
+        self.assertEqual(rows, [(2, "Blaue Funken Köln"), (3, "Schweiz"), (4, None)])
+
+    def test_rows_without_key_are_dropped(self):
+        df = pd.DataFrame(
+            {
+                "event_id": 307885,
+                "bib": pd.Series([1, pd.NA, 2], dtype="Int64"),
+                "name": ["Felipe Abella", "Markus Ackermann", "Seline Ackermann"],
+            }
+        )
+        for load in (lambda_function.upsert_table, lambda_function.replace_rows):
+            for writer in ("to_sql", "copy"):
+                with self.subTest(load=load.__name__, writer=writer):
+                    self.setUp()
+                    with self.engine.begin() as connection, self.assertLogs(lambda_function.logger, "WARNING"):
+                        stats = load(connection, df, "athletes_df", ["event_id", "bib"], writer)
+                        bibs = connection.execute(text('SELECT bib FROM "athletes_df" ORDER BY bib')).scalars().all()
+                    self.assertEqual(stats["inserted"], 2)
+                    self.assertEqual(stats["dropped"], 1)
+                    self.assertEqual(bibs, [1, 2])
+
+    def test_main_skips_unchanged_data(self):
+        athlete = ["", "", "Felipe ABELLA", "M", "", "M20-34", "", "", "", "SUI", "1993"]
+        config_data = {"key": "k1", "contests": {"1": "Olympisch", "5": "Jugendtriathlon U14"}, "splits": []}
+        participant_lists = {
+            "000-Startlists|Startlist": {
+                "data": {
+                    "#1_Olympisch": [["1660", *athlete[1:]], ["1697", *athlete[1:]]],
+                    "#5_Jugendtriathlon U14": [["278", *athlete[1:]]],
+                }
+            }
+        }
+
+        def run(*results, events=(EVENT,)):
+            with (
+                mock.patch.object(lambda_function, "fetch_events", return_value=list(results)),
+                mock.patch.object(lambda_function, "get_engine", return_value=self.engine),
+            ):
+                return lambda_function.main(events=list(events))
+
+        with mock.patch("builtins.print") as print_:
+            report = run((config_data, participant_lists, 0.1))
+        self.assertEqual(
+            report[307885]["tables"]["athletes_df"], {"inserted": 3, "updated": 0, "deleted": 0, "dropped": 0}
+        )
+
+        # every stage is printed as an EMF line and stored per run
+        with self.engine.begin() as connection:
+            metrics = connection.execute(
+                text(
+                    "SELECT event_id, stage, target, rows FROM \"pipeline_run_metrics\" WHERE stage IN ('process', 'write')"
+                )
+            ).all()
+        self.assertIn((307885, "process", "athletes_df", 3), metrics)
+        self.assertIn((307885, "write", "athletes_df", 3), metrics)
+        emf_lines = [json.loads(call.args[0]) for call in print_.call_args_list]
+        self.assertEqual(
+            {line["_aws"]["CloudWatchMetrics"][0]["Namespace"] for line in emf_lines}, {"TriathlonPipeline"}
+        )
+        self.assertLessEqual(
+            {"fingerprint", "process", "convert_countries", "write", "load"}, {line["stage"] for line in emf_lines}
+        )
+
+        # a new request key alone is not a change
+        report = run(({**config_data, "key": "k2"}, participant_lists, 0.1))
+        self.assertEqual(report[307885]["tables"], {})
+
+        # only the changed category is reprocessed, the other one is left alone
+        participant_lists["000-Startlists|Startlist"]["data"]["#1_Olympisch"] = [["1660", *athlete[1:]]]
+        report = run((config_data, participant_lists, 0.1))
+        self.assertEqual(
+            report[307885]["tables"],
+            {
+                "athletes_df": {"inserted": 0, "updated": 0, "deleted": 1, "dropped": 0},
+                "athletes_history": {"closed": 1, "opened": 0},
+            },
+        )
+
+        # another event with the same bibs is stored next to it, a failing event does not stop it
+        other_event = {**EVENT, "event_id": 1}
+        failing_event = {**EVENT, "event_id": 2}
+        with self.assertRaisesRegex(RuntimeError, r"events failed: \[2\]"):
+            run(
+                (config_data, participant_lists, 0.1),
+                (config_data, participant_lists, 0.1),
+                httpx.ConnectError("boom"),
+                events=(EVENT, other_event, failing_event),
+            )
+
+        with self.engine.begin() as connection:
+            bibs = connection.execute(text('SELECT event_id, bib FROM "athletes_df" ORDER BY 1, 2')).all()
+            events = connection.execute(
+                text(
+                    """
+                    SELECT athletes_count, used_data_hash FROM "dataset_update_events"
+                    WHERE event_id = 307885 ORDER BY created_at
+                    """
+                )
+            ).all()
+            used_data = lambda_function.load_raw_payload(connection, events[-1].used_data_hash)
+            history = connection.execute(
+                text('SELECT bib, valid_to IS NULL FROM "athletes_history" WHERE event_id = 307885 ORDER BY bib')
+            ).all()
+            countries = connection.execute(text('SELECT * FROM "athletes_by_country" ORDER BY event_id')).all()
+            country_lookup = connection.execute(text('SELECT country FROM "country_lookup"')).scalars().all()
+            rollup = connection.execute(
+                text(
+                    """
+                    SELECT contest_category, athletes_count FROM "athletes_hourly_rollup"
+                    WHERE event_id = 307885 AND hour = (SELECT max(hour) FROM "athletes_hourly_rollup")
+                    ORDER BY contest_category
+                    """
+                )
+            ).all()
+        self.assertEqual(bibs, [(1, 278), (1, 1660), (307885, 278), (307885, 1660)])
+        self.assertEqual(history, [(278, True), (1660, True), (1697, False)])
+        self.assertEqual(rollup, [("Jugendtriathlon U14", 1), ("Olympisch", 1)])
+        self.assertEqual(countries, [(1, "Switzerland", 2), (307885, "Switzerland", 2)])
+        self.assertEqual(country_lookup, ["Switzerland"])
+        self.assertEqual([count for count, _ in events], [3, 3, 2, 2])
+        self.assertEqual(used_data, {"config_data": config_data, "participant_lists": participant_lists})
+
+    def test_vanished_category_is_deleted(self):
+        athlete = ["", "", "Felipe ABELLA", "M", "", "M20-34", "", "", "", "SUI", "1993"]
+        waiting = ["", "", "", "Maximilian HOHL", "M", "", "", "GER"]
+        config_data = {"key": "k1", "contests": {"1": "Olympisch", "5": "Jugendtriathlon U14"}, "splits": []}
+
+        def run(categories):
+            participant_lists = {
+                EVENT["startlist"]: {"data": {f"#{c}": [[str(bib), *athlete[1:]]] for c, bib in categories}},
+                EVENT["waitlist"]: {
+                    "data": {
+                        f"#{c} - Warteliste": [[str(bib), str(bib), str(bib), *waiting[3:]]] for c, bib in categories
+                    }
+                },
+            }
+            with (
+                mock.patch.object(
+                    lambda_function, "fetch_events", return_value=[(config_data, participant_lists, 0.1)]
+                ),
+                mock.patch.object(lambda_function, "get_engine", return_value=self.engine),
+                mock.patch("builtins.print"),
+            ):
+                return lambda_function.main(events=[EVENT])
+
+        run([("1_Olympisch", 1660), ("5_Jugendtriathlon U14", 278)])
+        report = run([("1_Olympisch", 1660)])
+
+        with self.engine.begin() as connection:
+            bibs = connection.execute(text('SELECT bib FROM "athletes_df"')).scalars().all()
+            wait_list = connection.execute(text('SELECT id FROM "athletes_wait_list_df"')).scalars().all()
+            history = connection.execute(
+                text('SELECT bib, valid_to IS NULL FROM "athletes_history" ORDER BY bib')
+            ).all()
+            counts = (
+                connection.execute(text('SELECT athletes_count FROM "dataset_update_events" ORDER BY created_at'))
+                .scalars()
+                .all()
+            )
+        self.assertEqual(report[307885]["tables"]["athletes_df"]["deleted"], 1)
+        self.assertEqual(report[307885]["tables"]["athletes_wait_list_df"]["deleted"], 1)
+        self.assertEqual(bibs, [1660])
+        self.assertEqual(wait_list, [1660])
+        self.assertEqual(history, [(278, False), (1660, True)])
+        self.assertEqual(counts, [2, 1])
+
+    def test_validation_blocks_load(self):
+        athlete = ["", "", "Felipe ABELLA", "M", "", "M20-34", "", "", "", "SUI", "1993"]
+        config_data = {"key": "k1", "contests": {"1": "Olympisch"}, "splits": []}
+
+        def run(bibs):
+            participant_lists = {
+                EVENT["startlist"]: {"data": {"#1_Olympisch": [[str(bib), *athlete[1:]] for bib in bibs]}}
+            }
+            with (
+                mock.patch.object(
+                    lambda_function, "fetch_events", return_value=[(config_data, participant_lists, 0.1)]
+                ),
+                mock.patch.object(lambda_function, "get_engine", return_value=self.engine),
+                mock.patch("builtins.print"),
+            ):
+                return lambda_function.main(events=[EVENT])
+
+        run(range(1, 101))
+        for bibs, error in [
+            (range(1, 11), "90 of the previous run's 100 rows in contest category 1 are gone"),
+            ([*range(1, 101), 100], "unique bib: 1 of 101 rows"),
+        ]:
+            with self.subTest(error=error), self.assertLogs(lambda_function.logger, "ERROR") as logs:
+                with self.assertRaisesRegex(RuntimeError, r"events failed: \[307885\]"):
+                    run(bibs)
+                (exception,) = [record.exc_info[1] for record in logs.records if record.exc_info]
+                self.assertIsInstance(exception, lambda_function.ValidationError)
+                self.assertIn(error, str(exception))
+
+        with self.engine.begin() as connection:
+            athletes = connection.execute(text('SELECT count(*) FROM "athletes_df"')).scalar_one()
+            stages = connection.execute(
+                text("SELECT DISTINCT target FROM \"pipeline_run_metrics\" WHERE stage = 'validate'")
+            ).all()
+        self.assertEqual(athletes, 100)
+        self.assertIn(("athletes_df",), stages)
+
+    def test_failed_table_rolls_back_event(self):
+        athlete = ["", "", "Felipe ABELLA", "M", "", "M20-34", "", "", "", "SUI", "1993"]
+        config_data = {"key": "k1", "contests": {"1": "Olympisch"}, "splits": []}
+        participant_lists = {"000-Startlists|Startlist": {"data": {"#1_Olympisch": [["1660", *athlete[1:]]]}}}
+
+        def run(config_data, participant_lists):
+            with (
+                mock.patch.object(
+                    lambda_function, "fetch_events", return_value=[(config_data, participant_lists, 0.1)]
+                ),
+                mock.patch.object(lambda_function, "get_engine", return_value=self.engine),
+                mock.patch("builtins.print"),
+            ):
+                return lambda_function.main(events=[EVENT])
+
+        run(config_data, participant_lists)
+        changed_lists = {"000-Startlists|Startlist": {"data": {"#1_Olympisch": [["1697", *athlete[1:]]]}}}
+        with (
+            ThreadPoolExecutor(2) as executor,
+            mock.patch.object(lambda_function, "get_process_executor", return_value=executor),
+            mock.patch.object(lambda_function, "process_splits_data", side_effect=ValueError("boom")),
+            self.assertRaisesRegex(RuntimeError, r"events failed: \[307885\]"),
+        ):
+            run({**config_data, "splits": [{"ID": 1}]}, changed_lists)
+
+        # tables written before the splits failed are rolled back with the rest of the event
+        with self.engine.begin() as connection:
+            bibs = connection.execute(text('SELECT bib FROM "athletes_df"')).scalars().all()
+            events = connection.execute(text('SELECT count(*) FROM "dataset_update_events"')).scalar_one()
+        self.assertEqual((bibs, events), ([1660], 1))
+
+    def test_get_engine_through_pooler(self):
+        # TEST_POOLER_HOST points at a PgBouncer in transaction mode, otherwise Postgres stands in for the pooler
+        url = self.engine.url
+        settings = {"username": url.username, "password": url.password, "host": "unused", "dbname": url.database}
+        pooler = os.environ.get("TEST_POOLER_HOST") or f"{url.host or url.query['host']}:{url.port or 5432}"
+        with (
+            mock.patch.object(lambda_function, "_engine", None),
+            mock.patch.object(lambda_function, "get_settings", return_value=settings),
+            mock.patch.object(lambda_function, "DB_POOLER_HOST", pooler),
+        ):
+            engine = lambda_function.get_engine()
+            try:
+                for _ in range(10):  # beyond psycopg's prepare threshold
+                    with engine.connect() as connection:
+                        self.assertEqual(connection.execute(text("SELECT :n"), {"n": 1}).scalar_one(), 1)
+                        self.assertIsNone(connection.connection.driver_connection.prepare_threshold)
+                self.assertIs(lambda_function.get_engine(), engine)
+                self.assertEqual(engine.pool.checkedin(), 1)
+            finally:
+                engine.dispose()
+
+    def test_migrate_schema(self):
+        # athletes_df as created before the managed DDL, with pandas-inferred types
+        df = pd.DataFrame(
+            {
+                "event_id": [307885],
+                "bib": pd.Series([1660], dtype="Int64"),
+                "gender": ["Male"],
+                "contest_category_id": pd.Series([1], dtype="Int64"),
+                "country": ["Switzerland"],
+            }
+        )
+        with self.engine.begin() as connection:
+            df.to_sql("athletes_df", connection, index=False)
+            connection.execute(text('ALTER TABLE "athletes_df" ADD PRIMARY KEY (event_id, bib)'))
+
+        for _ in range(2):
+            with self.engine.begin() as connection:
+                lambda_function.migrate_schema(connection)
+
+        with self.engine.begin() as connection:
+            inspector = sqlalchemy.inspect(connection)
+            types = {column["name"]: str(column["type"]) for column in inspector.get_columns("athletes_df")}
+            foreign_keys = sorted(fk["referred_table"] for fk in inspector.get_foreign_keys("athletes_df"))
+            indexes = sorted(index["name"] for index in inspector.get_indexes("athletes_df"))
+            genders = connection.execute(text('SELECT gender FROM "gender_lookup"')).scalars().all()
+        self.assertEqual(types["bib"], "INTEGER")
+        self.assertEqual(types["contest_category_id"], "SMALLINT")
+        self.assertEqual(foreign_keys, ["contest_category_lookup", "gender_lookup"])
+        self.assertEqual(indexes, ["athletes_df_event_id_contest_category_id_idx"])
+        self.assertEqual(genders, ["Male"])
+
+    def test_dashboard_queries_use_indexes(self):
+        athlete = ["", "", "Felipe ABELLA", "M", "", "M20-34", "TV Zürich", "Company", "", "SUI", "1993"]
+        config_data = {"key": "k1", "contests": {"1": "Olympisch"}, "splits": []}
+        participant_lists = {
+            "000-Startlists|Startlist": {"data": {"#1_Olympisch": [[str(bib), *athlete[1:]] for bib in range(100)]}}
+        }
+        with (
+            mock.patch.object(lambda_function, "fetch_events", return_value=[(config_data, participant_lists, 0.1)]),
+            mock.patch.object(lambda_function, "get_engine", return_value=self.engine),
+            mock.patch("builtins.print"),
+        ):
+            lambda_function.main(events=[EVENT])
+            lambda_function.main(events=[EVENT])
+
+        dashboard = json.loads(DASHBOARD_PATH.read_text(encoding="utf-8"))
+        queries = {panel["title"]: panel["targets"][0]["rawSql"] for panel in dashboard["panels"]}
+        # every panel shows the event picked in the event_id variable, not a sum over all events
+        self.assertEqual([variable["name"] for variable in dashboard["templating"]["list"]], ["event_id"])
+        self.assertEqual([title for title, sql in queries.items() if "event_id = $event_id" not in sql], [])
+        queries["Event variable"] = dashboard["templating"]["list"][0]["query"]
+        queries["Scoped delete"] = 'SELECT * FROM "athletes_df" WHERE event_id = 307885 AND contest_category_id = 1'
+        # the athletes_by_* summary tables hold a few rows per event and are fine to scan whole
+        row_tables = {"athletes_df", "athletes_wait_list_df", "dataset_update_events", "pipeline_run_metrics"}
+
+        def seq_scanned(node):
+            scanned = {node["Relation Name"]} if node["Node Type"] == "Seq Scan" else set()
+            return scanned.union(*(seq_scanned(child) for child in node.get("Plans", [])))
+
+        with self.engine.begin() as connection:
+            connection.execute(text("SET LOCAL enable_seqscan = off"))
+            for title, sql in queries.items():
+                sql = re.sub(r"\$__timeFilter\((\w+)\)", r"\1 > now() - interval '1 day'", sql)
+                sql = sql.replace("$event_id", str(EVENT["event_id"]))
+                with self.subTest(panel=title):
+                    plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar_one()
+                    self.assertFalse(seq_scanned(plan[0]["Plan"]) & row_tables)
+
+    def test_migrate_used_data(self):
+        payload = {"config_data": {"key": "k1"}, "participant_lists": {"000-Startlists|Startlist": {"data": {}}}}
+        events = pd.DataFrame(
+            {
+                "created_at": pd.to_datetime(["2024-11-01 10:00", "2024-11-01 11:00"], utc=True),
+                "used_data": [json.dumps(payload)] * 2,
+                "athletes_count": [0, 0],
+                "athletes_wait_list_count": [0, 0],
+            }
+        )
+        with self.engine.begin() as connection:
+            events.to_sql("dataset_update_events", connection, index=False)
+            stats = lambda_function.migrate_used_data(connection)
+            hashes = (
+                connection.execute(
+                    text('SELECT DISTINCT used_data_hash FROM "dataset_update_events" WHERE used_data IS NULL')
+                )
+                .scalars()
+                .all()
+            )
+            self.assertEqual(lambda_function.load_raw_payload(connection, hashes[0]), payload)
+            event_ids = connection.execute(text('SELECT event_id FROM "dataset_update_events"')).scalars().all()
+        self.assertEqual(stats["events"], 2)
+        self.assertEqual(stats["event_ids"], 2)
+        self.assertEqual(len(hashes), 1)
+        self.assertEqual(event_ids, [lambda_function.LEGACY_EVENT_ID] * 2)
+
+    def test_store_raw_payload_reuses_fingerprints(self):
+        config_data = {"key": "k1", "contests": {"1": "Olympisch"}}
+        participant_lists = {"000-Startlists|Startlist": {"data": {"#1_Olympisch": [["1660", "Felipe ABELLA"]]}}}
+        fingerprints = lambda_function.fingerprint_payload(config_data, participant_lists)
+        with self.engine.begin() as connection:
+            lambda_function.ensure_audit_schema(connection)
+            first = lambda_function.store_raw_payload(connection, config_data, participant_lists, fingerprints)
+            canonical_chunks = lambda_function.canonical_chunks
+            with mock.patch.object(lambda_function, "canonical_chunks", wraps=canonical_chunks) as serialized:
+                second = lambda_function.store_raw_payload(connection, config_data, participant_lists, fingerprints)
+            payload = lambda_function.load_raw_payload(connection, second)
+        self.assertEqual(first, second)
+        self.assertEqual(payload, {"config_data": config_data, "participant_lists": participant_lists})
+        # only the config and the manifest are serialized again, not the list
+        serialized_values = [call.args[0] for call in serialized.call_args_list]
+        self.assertIn(config_data, serialized_values)
+        self.assertNotIn(participant_lists["000-Startlists|Startlist"], serialized_values)
+
+    def test_live_writes_new_split_times(self):
+        event = {**EVENT, "results": "02-Results|Live"}
+        config_data = {
+            "key": "k1",
+            "contests": {"1": "Olympisch"},
+            "splits": [
+                {"ID": 1, "Name": "Swim", "Label": "Swim", "SplitType": 0, "Contest": 0, "TypeOfSport": 1},
+                {"ID": 4, "Name": "Finish", "Label": "Finish", "SplitType": 0, "Contest": 1, "TypeOfSport": 0},
+            ],
+            "lists": [],
+        }
+
+        def recording(*rows):
+            results = {"data": {"#1_Olympisch": list(rows)}, "DataFields": ["BIB", "DisplayName", "Swim", "Finish"]}
+            return {"config": config_data, "lists": {"02-Results|Live": results}}
+
+        recordings = [
+            recording(["1660", "Felipe Abella", "", ""], ["1697", "Markus Ackermann", "", ""]),
+            recording(["1660", "Felipe Abella", "24:03.1", ""], ["1697", "Markus Ackermann", "", ""]),
+            recording(["1660", "Felipe Abella", "24:03.1", ""], ["1697", "Markus Ackermann", "25:40.0", ""]),
+            recording(["1660", "Felipe Abella", "24:03.1", "2:01:10"], ["1697", "Markus Ackermann", "25:40.0", ""]),
+        ]
+        intervals = []
+
+        async def sleep(interval):
+            intervals.append(interval)
+
+        with mock.patch.object(lambda_function, "get_engine", return_value=self.engine):
+            written = lambda_function.live(
+                [event], lambda_function.replay_transport({307885: recordings}), max_polls=6, sleep=sleep
+            )
+
+        with self.engine.begin() as connection:
+            rows = connection.execute(text('SELECT bib, split_id, seconds FROM "split_times" ORDER BY 1, 2')).all()
+        self.assertEqual(written, {307885: 3})
+        self.assertEqual(rows, [(1660, 1, 1443.1), (1660, 4, 7270.0), (1697, 1, 1540.0)])
+        # back off while nothing changes, poll quickly again after a change
+        self.assertEqual(intervals, [3.0, 2.0, 2.0, 2.0, 3.0])
+
+        # a failing poll or write is logged and retried, the split times it saw are written later
+        self.setUp()
+        replay = lambda_function.replay_transport({307885: recordings})
+        list_requests = []
+        write_split_times = lambda_function.write_split_times
+        write_failures = [RuntimeError("connection lost")]
+        intervals.clear()
+
+        def handler(request):
+            if request.url.path.endswith("/list"):
+                list_requests.append(request)
+                if len(list_requests) == 2:
+                    return httpx.Response(503)
+            return replay.handler(request)
+
+        def flaky_write(connection, records):
+            if write_failures:
+                raise write_failures.pop()
+            return write_split_times(connection, records)
+
+        with (
+            mock.patch.object(lambda_function, "get_engine", return_value=self.engine),
+            mock.patch.object(lambda_function, "write_split_times", side_effect=flaky_write),
+            mock.patch.object(lambda_function, "FETCH_MAX_TRIES", 1),
+            self.assertLogs(lambda_function.logger, "ERROR") as logs,
+        ):
+            written = lambda_function.live([event], httpx.MockTransport(handler), max_polls=6, sleep=sleep)
+
+        with self.engine.begin() as connection:
+            rows = connection.execute(text('SELECT bib, split_id, seconds FROM "split_times" ORDER BY 1, 2')).all()
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(written, {307885: 3})
+        self.assertEqual(rows, [(1660, 1, 1443.1), (1660, 4, 7270.0), (1697, 1, 1540.0)])
+        self.assertEqual(intervals, [3.0, 4.5, 6.75, 2.0, 2.0])
+
 
 if __name__ == "__main__":
     unittest.main()